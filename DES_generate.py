@@ -7,6 +7,9 @@ Read in and cache the flows for DES in LCDM.
 ###############################################################################
 # initial imports:
 import os
+import re
+import glob
+import pickle
 import numpy as np
 
 import sys
@@ -14,16 +17,9 @@ here = './'
 temp_path = os.path.realpath(os.path.join(os.getcwd(), here+'tensiometer'))
 sys.path.insert(0, temp_path)
 import getdist
-from getdist import plots, MCSamples
-from getdist.gaussian_mixtures import GaussianND
-import analyze_2d_example
-import importlib
-import pickle
 
-import synthetic_probability
-from tensorflow.keras.callbacks import ReduceLROnPlateau
-callbacks = [ReduceLROnPlateau()]
-from tensorflow.keras.initializers import TruncatedNormal, Zeros, GlorotNormal
+# note: tensorflow and the flow library are imported inside the helpers below
+# so that loading chains does not pay the tensorflow startup cost.
 
 ###############################################################################
 # chains common settings:
@@ -32,6 +28,8 @@ from tensorflow.keras.initializers import TruncatedNormal, Zeros, GlorotNormal
 chains_dir = here+'/chains/'
 # the DES chain:
 settings = {'ignore_rows': 0.3, 'smooth_scale_1D': 0.3, 'smooth_scale_2D': 0.3}
+# binary columnar copies of the chains:
+columnar_dir = chains_dir+'columnar/'
 
 ###############################################################################
 # helper to load chains and train:
@@ -39,6 +37,13 @@ settings = {'ignore_rows': 0.3, 'smooth_scale_1D': 0.3, 'smooth_scale_2D': 0.3}
 
 def helper_load_chains(param_names, prior_chain, posterior_chain, flow_cache, prior_bijector='ranges', **kwargs):
 
+    # heavy imports:
+    import synthetic_probability
+    from getdist import plots
+    from tensorflow.keras.callbacks import ReduceLROnPlateau
+    from tensorflow.keras.initializers import GlorotNormal
+    callbacks = [ReduceLROnPlateau()]
+
     # initialize:
     num_params = len(param_names)
     nsamples = 100000
@@ -55,62 +60,263 @@ def helper_load_chains(param_names, prior_chain, posterior_chain, flow_cache, pr
     hidden_units = kwargs.get('hidden_units', [num_params]*2)
     kernel_initializer = kwargs.get('kernel_initializer', GlorotNormal())
     pop_size = kwargs.get('pop_size', 10)
+    successive_halving = kwargs.get('successive_halving', False)
 
     # prior flow:
-    if os.path.isfile(flow_cache+'/prior'+'_permutations.pickle'):
-        # load trained model:
-        temp_MAF = synthetic_probability.SimpleMAF.load(num_params, flow_cache+'/prior', n_maf=n_maf, hidden_units=hidden_units)
-        # initialize flow:
-        prior_flow = synthetic_probability.DiffFlowCallback(prior_chain,
-                                                            prior_bijector=prior_bijector,
-                                                            trainable_bijector=temp_MAF.bijector,
-                                                            param_names=param_names, feedback=0)
-    else:
-        # initialize prior flow:
-        prior_flow = synthetic_probability.DiffFlowCallback(prior_chain,
-                                                            prior_bijector=prior_bijector,
+    prior_flow, prior_key = synthetic_probability.load_flow(prior_chain, flow_cache,
                                                             param_names=param_names,
-                                                            feedback=1, n_maf=n_maf,
-                                                            hidden_units=hidden_units)
-        # train prior flow:
-        prior_flow.global_train(pop_size=pop_size, batch_size=batch_size, epochs=epochs, steps_per_epoch=steps_per_epoch, callbacks=callbacks, verbose=0)
-        # save trained model:
-        prior_flow.MAF.save(flow_cache+'/prior')
-        # plot:
+                                                            prior_bijector=prior_bijector,
+                                                            feedback=1, pop_size=pop_size,
+                                                            train_kwargs={'batch_size': batch_size, 'epochs': epochs, 'steps_per_epoch': steps_per_epoch, 'callbacks': callbacks, 'verbose': 0, 'successive_halving': successive_halving},
+                                                            n_maf=n_maf, hidden_units=hidden_units)
+    # plot:
+    if not os.path.isfile(flow_cache+'/0_learned_prior_distribution_'+prior_key+'.pdf'):
         g = plots.get_subplot_plotter()
-        g.triangle_plot([prior_chain, prior_flow.MCSamples(nsamples)], params=param_names, filled=False)
-        g.export(flow_cache+'/0_learned_prior_distribution.pdf')
+        g.triangle_plot([prior_chain, prior_flow.MCSamples(nsamples, use_pool=True)], params=param_names, filled=False)
+        g.export(flow_cache+'/0_learned_prior_distribution_'+prior_key+'.pdf')
 
     # posterior flow:
-    if os.path.isfile(flow_cache+'/posterior'+'_permutations.pickle'):
-        # load trained model:
-        temp_MAF = synthetic_probability.SimpleMAF.load(num_params, flow_cache+'/posterior', n_maf=n_maf, hidden_units=hidden_units)
-        # initialize flow:
-        posterior_flow = synthetic_probability.DiffFlowCallback(posterior_chain,
-                                                                prior_bijector=prior_bijector,
-                                                                trainable_bijector=temp_MAF.bijector,
-                                                                param_ranges=prior_flow.parameter_ranges,
-                                                                param_names=prior_flow.param_names,
-                                                                feedback=1,)
-    else:
-        # initialize posterior flow:
-        posterior_flow = synthetic_probability.DiffFlowCallback(posterior_chain,
-                                                                prior_bijector=prior_bijector,
-                                                                param_ranges=prior_flow.parameter_ranges,
-                                                                param_names=prior_flow.param_names,
-                                                                feedback=1,
-                                                                n_maf=n_maf, hidden_units=hidden_units, kernel_initializer=kernel_initializer) #kernel_initializer=TruncatedNormal(stddev=1e-3))
-        # train posterior flow:
-        posterior_flow.global_train(pop_size=pop_size, batch_size=batch_size, epochs=epochs, steps_per_epoch=steps_per_epoch, callbacks=callbacks, verbose=0)
-        # save trained model:
-        posterior_flow.MAF.save(flow_cache+'/posterior')
-        # plot posterior:
+    posterior_flow, posterior_key = synthetic_probability.load_flow(posterior_chain, flow_cache,
+                                                                    param_names=prior_flow.param_names,
+                                                                    param_ranges=prior_flow.parameter_ranges,
+                                                                    prior_bijector=prior_bijector,
+                                                                    feedback=1, pop_size=pop_size, find_MAP=True,
+                                                                    train_kwargs={'batch_size': batch_size, 'epochs': epochs, 'steps_per_epoch': steps_per_epoch, 'callbacks': callbacks, 'verbose': 0, 'successive_halving': successive_halving},
+                                                                    n_maf=n_maf, hidden_units=hidden_units, kernel_initializer=kernel_initializer)
+    # plot posterior:
+    if not os.path.isfile(flow_cache+'/0_learned_posterior_distribution_'+posterior_key+'.pdf'):
         g = plots.get_subplot_plotter()
-        g.triangle_plot([posterior_chain, posterior_flow.MCSamples(nsamples)], params=param_names, filled=False)
-        g.export(flow_cache+'/0_learned_posterior_distribution.pdf')
+        g.triangle_plot([posterior_chain, posterior_flow.MCSamples(nsamples, use_pool=True)], params=param_names, filled=False)
+        g.export(flow_cache+'/0_learned_posterior_distribution_'+posterior_key+'.pdf')
 
     return prior_flow, posterior_flow
 
+###############################################################################
+# chain loading:
+
+
+def _chain_source(file_root):
+    """
+    Name, size and modification time of the text files of a chain, used to detect changes.
+    """
+    base = os.path.basename(file_root)
+    files = [file for file in glob.glob(chains_dir+file_root+'*')
+             if os.path.isfile(file) and re.match(re.escape(base)+r'(_\d+)?\..+$', os.path.basename(file))]
+    #
+    return sorted((os.path.basename(file), os.path.getsize(file), os.path.getmtime(file)) for file in files)
+
+
+def _save_atomic(file, save, obj):
+    """
+    Save to a temporary file and rename it, so that other processes never read a partial file.
+    """
+    temp_file = file+'.{}.tmp'.format(os.getpid())
+    with open(temp_file, 'wb') as f:
+        save(f, obj)
+    os.replace(temp_file, file)
+
+
+def convert_chain(file_root, force=False):
+    """
+    Convert a chain to a binary columnar format: one ``.npy`` file per parameter,
+    plus weights, log likelihoods and metadata (names, labels, derived flags, ranges).
+    The text files are parsed, with the common settings, only the first time or when they change.
+
+    :param file_root: root of the chain files, relative to ``chains_dir``.
+    :param force: convert even if an up to date copy exists.
+    :return: the metadata of the chain.
+    """
+    path = columnar_dir+file_root
+    meta_file = os.path.join(path, 'metadata.pickle')
+    source = _chain_source(file_root)
+    if not force and os.path.isfile(meta_file):
+        metadata = pickle.load(open(meta_file, 'rb'))
+        if metadata['source'] == source and metadata['settings'] == settings:
+            return metadata
+    # parse the text chain:
+    chain = getdist.mcsamples.loadMCSamples(file_root=chains_dir+file_root, no_cache=True, settings=settings)
+    if not os.path.exists(path):
+        os.makedirs(path)
+    param_names = chain.getParamNames()
+    names = param_names.list()
+    for i, name in enumerate(names):
+        _save_atomic(os.path.join(path, name+'.npy'), np.save, np.ascontiguousarray(chain.samples[:, i]))
+    _save_atomic(os.path.join(path, 'weights.npy'), np.save, np.ascontiguousarray(chain.weights))
+    if chain.loglikes is not None:
+        _save_atomic(os.path.join(path, 'loglikes.npy'), np.save, np.ascontiguousarray(chain.loglikes))
+    metadata = {'source': source,
+                'settings': dict(settings),
+                'num_samples': chain.samples.shape[0],
+                'names': names,
+                'labels': [param_names.parWithName(name).label for name in names],
+                'derived': [param_names.parWithName(name).isDerived for name in names],
+                'ranges': {name: [chain.ranges.getLower(name), chain.ranges.getUpper(name)] for name in names},
+                'positive': [name for i, name in enumerate(names) if np.all(chain.samples[:, i] > 0.)],
+                'sampler': chain.sampler,
+                'has_loglikes': chain.loglikes is not None,
+                }
+    # metadata last, so that an interrupted conversion is redone:
+    _save_atomic(meta_file, pickle.dump, metadata)
+    #
+    return metadata
+
+
+def chain_column(file_root, name):
+    """
+    Memory-mapped column of a converted chain.
+    ``log_`` columns of positive parameters are computed on first access and stored with the others.
+
+    :param file_root: root of the chain files, relative to ``chains_dir``.
+    :param name: name of the parameter.
+    :return: read-only memory-mapped array.
+    """
+    file = os.path.join(columnar_dir+file_root, name+'.npy')
+    if not os.path.isfile(file):
+        if not name.startswith('log_'):
+            raise ValueError('Parameter '+name+' is not in chain '+file_root)
+        _save_atomic(file, np.save, np.log(chain_column(file_root, name[4:])))
+    #
+    return np.load(file, mmap_mode='r')
+
+
+def load_chain(file_root, add_log=True, param_names=None):
+    """
+    Load a chain from the chains folder with the common settings.
+    The chain is read from its binary columnar copy (see :func:`convert_chain`), so that only the requested columns are read.
+
+    :param file_root: root of the chain files, relative to ``chains_dir``.
+    :param add_log: whether to add the ``log_`` derived parameters of the positive parameters that are loaded.
+    :param param_names: list of parameters to load, can include ``log_`` parameters. Defaults to all parameters.
+    :return: the getdist MCSamples.
+    """
+    metadata = convert_chain(file_root)
+    names = metadata['names']
+    param_names = list(names) if param_names is None else list(param_names)
+    if add_log:
+        param_names += ['log_'+name for name in list(param_names) if name in metadata['positive'] and 'log_'+name not in param_names]
+    # labels and derived flags, log parameters are derived:
+    labels, derived, ranges = [], [], {}
+    for name in param_names:
+        if name in names:
+            ind = names.index(name)
+            labels.append(metadata['labels'][ind])
+            derived.append(metadata['derived'][ind])
+            ranges[name] = metadata['ranges'][name]
+        else:
+            labels.append('\\log '+metadata['labels'][names.index(name[4:])])
+            derived.append(True)
+    # read the columns:
+    samples = np.empty((metadata['num_samples'], len(param_names)))
+    for i, name in enumerate(param_names):
+        samples[:, i] = chain_column(file_root, name)
+    loglikes = None
+    if metadata['has_loglikes']:
+        loglikes = np.array(np.load(os.path.join(columnar_dir+file_root, 'loglikes.npy'), mmap_mode='r'))
+    weights = np.array(np.load(os.path.join(columnar_dir+file_root, 'weights.npy'), mmap_mode='r'))
+    # burn in was removed in the conversion:
+    chain = getdist.MCSamples(samples=samples, weights=weights, loglikes=loglikes,
+                              names=[name+'*' if der else name for name, der in zip(param_names, derived)],
+                              labels=labels, ranges=ranges, sampler=metadata['sampler'],
+                              name_tag=os.path.basename(file_root), settings=dict(settings, ignore_rows=0))
+    chain.updateBaseStatistics()
+    #
+    return chain
+
+
+###############################################################################
+# lazy example modules:
+
+
+_identity_bj = None
+
+
+def identity_bijector():
+    """
+    Identity bijector with an empty name, used to leave some parameters
+    untouched in a log transformation.
+    Built on first call so that tensorflow_probability is imported only when needed.
+    """
+    global _identity_bj
+    if _identity_bj is None:
+        from tensorflow_probability import bijectors as bj
+
+        class identity_bj(bj.Identity):
+            @property
+            def name(self):
+                return ''
+
+        _identity_bj = identity_bj
+    #
+    return _identity_bj
+
+
+def lazy_example(module_name, out_folder, chain_roots, flows):
+    """
+    Build the module level ``__getattr__`` of an example module.
+    Chains and flows are created on first attribute access and stored on the module,
+    so that a script only loads the chains and flows that it uses.
+
+    :param module_name: name of the example module, ``__name__``.
+    :param out_folder: folder where the flow caches are stored.
+    :param chain_roots: dictionary of chain attribute names and chain file roots.
+        Chains used by the flows only load the flow parameters and their ``log_`` parameters.
+    :param flows: dictionary of flow names and tuples
+        ``(prior chain name, posterior chain name, param_names, log flow name, log transformation)``.
+        The log transformation is a list with ``'log'`` or ``'identity'`` for each parameter.
+        Each entry defines the attributes ``<name>_prior_flow``, ``<name>_posterior_flow``
+        and the corresponding ``<log name>_prior_flow``, ``<log name>_posterior_flow``.
+    :return: the ``__getattr__`` function.
+    """
+    # parameters of the chains that are used by the flows:
+    chain_params = {}
+    for prior_chain, posterior_chain, param_names, _, _ in flows.values():
+        for chain in [prior_chain, posterior_chain]:
+            temp = chain_params.setdefault(chain, [])
+            temp += [name for name in param_names if name not in temp]
+    # map attribute names to the flow they belong to:
+    flow_attributes = {}
+    for name, (_, _, _, log_name, _) in flows.items():
+        for which in ['prior', 'posterior']:
+            flow_attributes[name+'_'+which+'_flow'] = (name, False)
+            if log_name is not None:
+                flow_attributes[log_name+'_'+which+'_flow'] = (name, True)
+
+    def _build_flows(module, name, log):
+        prior_chain, posterior_chain, param_names, log_name, transformation = flows[name]
+        if not log:
+            temp = helper_load_chains(param_names, getattr(module, prior_chain), getattr(module, posterior_chain), out_folder+name+'_flow_cache')
+            return name, temp
+        # log flows wrap the flows in the original parameters:
+        import synthetic_probability
+        from tensorflow_probability import bijectors as bj
+        transformation = [bj.Log() if t == 'log' else identity_bijector()() for t in transformation]
+        temp = [synthetic_probability.TransformedDiffFlowCallback(getattr(module, name+'_'+which+'_flow'), transformation)
+                for which in ['prior', 'posterior']]
+        return log_name, temp
+
+    def __getattr__(attribute):
+        module = sys.modules[module_name]
+        if attribute in chain_roots:
+            value = load_chain(chain_roots[attribute], param_names=chain_params.get(attribute, None))
+        elif attribute == 'chains':
+            value = [getattr(module, name) for name in chain_roots]
+        elif attribute == 'identity_bj':
+            value = identity_bijector()
+        elif attribute in flow_attributes:
+            # prior and posterior are always built together:
+            name, temp = _build_flows(module, *flow_attributes[attribute])
+            setattr(module, name+'_prior_flow', temp[0])
+            setattr(module, name+'_posterior_flow', temp[1])
+            return getattr(module, attribute)
+        else:
+            raise AttributeError('module {!r} has no attribute {!r}'.format(module_name, attribute))
+        # memoize:
+        setattr(module, attribute, value)
+        #
+        return value
+
+    return __getattr__
+
 
 if __name__ == '__main__':
 
@@ -36,7 +36,6 @@ from tensorflow.keras.callbacks import ReduceLROnPlateau
 callbacks = [ReduceLROnPlateau()]
 from getdist import plots, MCSamples
 
-from scipy import optimize
 from scipy.integrate import simps
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
@@ -48,34 +47,14 @@ from tensiometer import utilities
 from tensiometer import gaussian_tension
 from tensiometer import mcmc_tension
 
+# helper function to get levels:
+from utilities import get_levels
+
 # tensorflow imports:
 import tensorflow as tf
 import tensorflow_probability as tfp
 
 ###############################################################################
-# general utility functions:
-
-
-# helper function to get levels:
-def get_levels(P, x, y, conf=[0.95, 0.68]):
-    """
-    Get levels from a 2D grid
-    """
-    def _helper(alpha):
-        _P = P.copy()
-        _P[_P < alpha] = 0.
-        return simps(simps(_P, y), x)
-    levs = []
-    for c in conf:
-        try:
-            res = optimize.brentq(lambda x: _helper(x)-c, np.amin(P), np.amax(P))
-            levs.append(res)
-        except:
-            print('Cannot generate proper levels')
-            levs = len(conf)
-            break
-
-    return levs
 
 
 def run_KL_example_2d(chain, prior_chain, flow, prior_flow, param_names, outroot, param_ranges=None, use_MAP=True):
@@ -117,13 +96,11 @@ def run_KL_example_2d(chain, prior_chain, flow, prior_flow, param_names, outroot
     levels_5 = [utilities.from_sigma_to_confidence(i) for i in range(5, 0, -1)]
     levels_3 = [utilities.from_sigma_to_confidence(i) for i in range(3, 0, -1)]
 
-    log_P = flow.log_probability(np.array([X, Y], dtype=np.float32).T)
-    log_P = np.array(log_P).T
+    log_P = flow.grid_evaluation(x, y)['log_probability']
     P = np.exp(log_P)
     P = P / simps(simps(P, y), x)
 
-    log_Pi = prior_flow.log_probability(np.array([X, Y], dtype=np.float32).T)
-    log_Pi = np.array(log_Pi).T
+    log_Pi = prior_flow.grid_evaluation(x, y)['log_probability']
     Pi = np.exp(log_Pi)
     Pi = Pi / simps(simps(Pi, y), x)
 
@@ -454,14 +431,9 @@ def run_KL_example_2d(chain, prior_chain, flow, prior_flow, param_names, outroot
     _, temp_start_2, __ = solve_KL_ode(flow, prior_flow, flow.cast(y0), n=1, length=length, num_points=101, side='-')
     start_0 = np.concatenate((temp_start_2[::101//5][:-1], temp_start_1[::101//5]))
 
-    # solve:
-    modes_0, modes_1 = [], []
-    for start in start_0:
-        _, mode, _ = solve_KL_ode(flow, prior_flow, flow.cast(start), n=0, length=length, num_points=100)
-        modes_0.append(mode)
-    for start in start_1:
-        _, mode, _ = solve_KL_ode(flow, prior_flow, flow.cast(start), n=1, length=length, num_points=100)
-        modes_1.append(mode)
+    # solve all the modes at once:
+    _, modes_0, _, _ = synthetic_probability.solve_batch_KL_ode(flow, prior_flow, start_0, n=0, length=length, num_points=100)
+    _, modes_1, _, _ = synthetic_probability.solve_batch_KL_ode(flow, prior_flow, start_1, n=1, length=length, num_points=100)
     # plot:
     plt.figure(figsize=(2*figsize[0], figsize[1]))
     gs = gridspec.GridSpec(1, 2)
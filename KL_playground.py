@@ -23,7 +23,6 @@ import tensorflow as tf
 import tensorflow_probability as tfp
 tfb = tfp.bijectors
 tfd = tfp.distributions
-from scipy import optimize
 from scipy.integrate import simps
 
 import synthetic_probability
@@ -36,7 +35,8 @@ import pickle
 from getdist import plots, MCSamples
 from getdist.gaussian_mixtures import GaussianND
 import tensiometer.gaussian_tension as gaussian_tension
-from scipy import optimize
+# helper function to get levels:
+from utilities import get_levels
 
 import example_1_generate as example
 
@@ -51,20 +51,6 @@ prior_flow=example.prior_flow
 prior_param_names=example.prior_chain.getParamNames().list()
 prior_outroot=example.out_folder+'prior_'
 
-def get_levels(P, x, y, conf=[0.95, 0.68]):
-    """
-    Get levels from a 2D grid
-    """
-    def _helper(alpha):
-        _P = P.copy()
-        _P[_P < alpha] = 0.
-        return simps(simps(_P, y), x)
-    levs = []
-    for c in conf:
-        res = optimize.brentq(lambda x: _helper(x)-c, np.amin(P), np.amax(P))
-        levs.append(res)
-    return levs
-
 # plotting preferences:
 figsize = (8, 8)
 fontsize = 15
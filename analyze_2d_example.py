@@ -38,11 +38,11 @@ from tensorflow.keras.callbacks import ReduceLROnPlateau
 callbacks = [ReduceLROnPlateau()]
 from getdist import plots, MCSamples
 
-from scipy import optimize
 from scipy.integrate import simps
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 import scipy.stats
+import scipy.optimize
 import matplotlib.gridspec as gridspec
 
 # import the tensiometer tools that we need:
@@ -50,36 +50,13 @@ from tensiometer import utilities
 from tensiometer import gaussian_tension
 from tensiometer import mcmc_tension
 
+# helper function to get levels:
+from utilities import get_levels
+
 # tensorflow imports:
 import tensorflow as tf
 import tensorflow_probability as tfp
 
-###############################################################################
-# general utility functions:
-
-
-# helper function to get levels:
-def get_levels(P, x, y, conf=[0.95, 0.68]):
-    """
-    Get levels from a 2D grid
-    """
-    def _helper(alpha):
-        _P = P.copy()
-        _P[_P < alpha] = 0.
-        return simps(simps(_P, y), x)
-    levs = []
-    for c in conf:
-        try:
-            res = optimize.brentq(lambda x: _helper(x)-c, np.amin(P), np.amax(P))
-            levs.append(res)
-        except:
-            print('Cannot generate proper levels')
-            levs = len(conf)
-            break
-    levs = np.sort(levs)
-    return levs
-
-
 ###############################################################################
 
 def run_example_2d(chain, flow, param_names, outroot, param_ranges=None, use_MAP=True):
@@ -148,8 +125,7 @@ def run_example_2d(chain, flow, param_names, outroot, param_ranges=None, use_MAP
     print('2) learned posterior from samples')
 
     # compute flow probability on a grid:
-    log_P = flow.log_probability(np.array([X, Y], dtype=np.float32).T)
-    log_P = np.array(log_P).T
+    log_P = flow.grid_evaluation(x, y)['log_probability']
     P = np.exp(log_P)
     P = P / simps(simps(P, y), x)
 
@@ -193,8 +169,7 @@ def run_example_2d(chain, flow, param_names, outroot, param_ranges=None, use_MAP
     print('3) log determinant')
 
     # compute log determinant of metric:
-    log_det = flow.log_det_metric(np.array([X, Y], dtype=np.float32).T)
-    log_det = np.array(log_det).T
+    log_det = flow.grid_evaluation(x, y)['log_det_metric']
 
     # plot meshgrid of log determinant
     plt.figure(figsize=figsize)
@@ -502,13 +477,10 @@ def run_example_2d(chain, flow, param_names, outroot, param_ranges=None, use_MAP
     # feedback:
     print('9) local metric eigenvalues')
 
-    coords = np.array([X, Y], dtype=np.float32).reshape(2, -1).T
-
-    # compute the metric at all coordinates
-    local_metrics = flow.metric(coords)
-
-    # compute the PCA eigenvalues and eigenvectors of each local metric
-    PCA_eig, PCA_eigv = np.linalg.eigh(local_metrics)
+    # get the PCA eigenvalues and eigenvectors of each local metric
+    grid = flow.grid_evaluation(x, y)
+    PCA_eig = grid['metric_eigenvalues'].reshape(-1, 2)
+    PCA_eigv = grid['metric_eigenvectors'].reshape(-1, 2, 2)
 
     # sort PCA so first mode is index 0
     idx = np.argsort(PCA_eig, axis=1)[0]
@@ -670,14 +642,9 @@ def run_example_2d(chain, flow, param_names, outroot, param_ranges=None, use_MAP
     _, temp_start_2 = solve_eigenvalue_ode_par(flow.cast(y0), n=1, length=length, num_points=101, side='-')
     start_0 = np.concatenate((temp_start_2[::101//5][:-1], temp_start_1[::101//5]))
 
-    # solve:
-    modes_0, modes_1 = [], []
-    for start in start_0:
-        _, mode = solve_eigenvalue_ode_par(start, n=0, length=length, num_points=100)
-        modes_0.append(mode)
-    for start in start_1:
-        _, mode = solve_eigenvalue_ode_par(start, n=1, length=length, num_points=100)
-        modes_1.append(mode)
+    # solve all the modes at once:
+    _, modes_0 = flow.solve_batch_eigenvalue_ode_par(start_0, n=0, length=length, num_points=100)
+    _, modes_1 = flow.solve_batch_eigenvalue_ode_par(start_1, n=1, length=length, num_points=100)
 
     # plot:
     plt.figure(figsize=(2*figsize[0], figsize[1]))
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks of the flow hot paths.
+
+Flows are trained on synthetic Gaussian and banana chains, so no data files are needed,
+and the main operations of :class:`synthetic_probability.DiffFlowCallback` are timed
+for a range of dimensions and batch sizes.
+Results are written to a json file, named after the current git commit, that can be
+compared with the results of another commit.
+
+Usage::
+
+    python benchmark_flows.py [--dims 2 5 10 30] [--batch-sizes 100 1000 10000] [--operations ...]
+    python benchmark_flows.py --compare old.json new.json
+"""
+
+###############################################################################
+# initial imports:
+
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import argparse
+import subprocess
+import numpy as np
+
+here = './'
+temp_path = os.path.realpath(os.path.join(os.getcwd(), here+'tensiometer'))
+sys.path.insert(0, temp_path)
+from getdist import MCSamples
+from getdist.gaussian_mixtures import GaussianND
+
+###############################################################################
+# initial settings:
+
+# output folder:
+out_folder = './results/benchmarks/'
+
+# all operations that can be benchmarked:
+operations = ['train', 'sample', 'log_probability', 'metric', 'levi_civita_connection',
+              'solve_eigenvalue_ode_abs', 'solve_KL_ode', 'MAP_finder']
+# operations that are timed for each batch size:
+batched_operations = ['sample', 'log_probability', 'metric', 'levi_civita_connection']
+
+###############################################################################
+# synthetic chains:
+
+
+def gaussian_chain(dim, n_samples=100000, seed=0):
+    """
+    Correlated Gaussian chain.
+
+    :param dim: number of parameters.
+    :param n_samples: number of samples.
+    :param seed: random seed of the covariance and of the samples.
+    :return: getdist MCSamples.
+    """
+    rng = np.random.default_rng(seed)
+    # random covariance with a spread of scales:
+    temp = rng.normal(size=(dim, dim))
+    rot, _ = np.linalg.qr(temp)
+    cov = np.dot(rot*np.logspace(-1., 0., dim)**2, rot.T)
+    mean = rng.normal(size=dim)
+    gauss = GaussianND(mean, cov, names=['p'+str(i+1) for i in range(dim)])
+    np.random.seed(seed)
+    #
+    return gauss.MCSamples(size=n_samples, label='gaussian')
+
+
+def banana_chain(dim, n_samples=100000, seed=0, bend=1.):
+    """
+    Banana shaped chain. A standard Gaussian where every odd parameter
+    is shifted by the square of the preceding one.
+
+    :param dim: number of parameters.
+    :param n_samples: number of samples.
+    :param seed: random seed.
+    :param bend: amplitude of the quadratic shift.
+    :return: getdist MCSamples.
+    """
+    names = ['p'+str(i+1) for i in range(dim)]
+    gauss = GaussianND(np.zeros(dim), np.identity(dim), names=names)
+    np.random.seed(seed)
+    samples = gauss.MCSamples(size=n_samples).samples
+    samples[:, 1::2] += bend*(samples[:, 0:dim-1:2]**2 - 1.)
+    #
+    return MCSamples(samples=samples, names=names, label='banana', sampler='uncorrelated')
+
+
+def uniform_prior_chain(chain, n_samples=100000, seed=0):
+    """
+    Uniform prior chain covering the range of a chain.
+
+    :param chain: getdist MCSamples.
+    :param n_samples: number of samples.
+    :param seed: random seed.
+    :return: getdist MCSamples.
+    """
+    rng = np.random.default_rng(seed)
+    mins, maxs = np.amin(chain.samples, axis=0), np.amax(chain.samples, axis=0)
+    samples = rng.uniform(mins, maxs, size=(n_samples, len(mins)))
+    #
+    return MCSamples(samples=samples, names=chain.getParamNames().list(), label='prior', sampler='uncorrelated')
+
+
+chain_generators = {'gaussian': gaussian_chain, 'banana': banana_chain}
+
+###############################################################################
+# timing helpers:
+
+
+def time_function(function, repeats=5):
+    """
+    Time a function. The first call is not timed, so that tracing and
+    compilation of tf.function code is excluded.
+
+    :param function: function without arguments.
+    :param repeats: number of timed calls.
+    :return: dictionary with the compile (first call) time and the minimum, median and mean times in seconds.
+    """
+    t0 = time.perf_counter()
+    function()
+    first = time.perf_counter() - t0
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - t0)
+    #
+    return {'first': first, 'min': float(np.amin(times)), 'median': float(np.median(times)), 'mean': float(np.mean(times)), 'repeats': repeats}
+
+
+def environment():
+    """
+    Description of the environment the benchmarks run in.
+    """
+    import tensorflow as tf
+    import tensorflow_probability as tfp
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+        dirty = len(subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], stderr=subprocess.DEVNULL)) > 0
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = 'unknown', False
+    #
+    return {'commit': commit,
+            'dirty': dirty,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'host': socket.gethostname(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'tensorflow': tf.__version__,
+            'tensorflow_probability': tfp.__version__,
+            'devices': [device.name for device in tf.config.list_physical_devices()],
+            }
+
+###############################################################################
+# benchmarks:
+
+
+def benchmark_flow(chain_name, dim, batch_sizes, operations=operations, n_samples=100000, repeats=5,
+                   train_steps=20, train_batch_size=1000, ode_points=20, MAP_maxiter=10, feedback=1):
+    """
+    Benchmark the operations of a flow trained on one synthetic chain.
+
+    :param chain_name: name of the synthetic chain, 'gaussian' or 'banana'.
+    :param dim: number of parameters.
+    :param batch_sizes: list of batch sizes for the batched operations.
+    :param operations: list of operations to benchmark.
+    :param n_samples: number of samples of the chain.
+    :param repeats: number of timed calls of each operation.
+    :param train_steps: number of training steps per timed epoch.
+    :param train_batch_size: training batch size.
+    :param ode_points: number of solution points of the ODE solvers.
+    :param MAP_maxiter: maximum number of differential evolution generations of the MAP finder.
+    :param feedback: feedback level.
+    :return: list of result dictionaries.
+    """
+    import tensorflow as tf
+    import synthetic_probability
+    # initialize:
+    results = []
+
+    def _record(operation, batch_size, timing, items):
+        timing.update({'chain': chain_name, 'dim': dim, 'operation': operation, 'batch_size': batch_size,
+                       'throughput': items/timing['median'] if timing['median'] > 0. else None})
+        results.append(timing)
+        if feedback > 0:
+            print('  {:<8} dim={:<3} {:<26} batch={:<8} median={:.4g} s'.format(chain_name, dim, operation, str(batch_size), timing['median']))
+    # build the flow:
+    chain = chain_generators[chain_name](dim, n_samples=n_samples)
+    flow = synthetic_probability.DiffFlowCallback(chain, feedback=0, diagnostics_every=0)
+    # train, one epoch of train_steps steps is timed:
+    timing = time_function(lambda: flow.train(epochs=1, batch_size=train_batch_size, steps_per_epoch=train_steps, verbose=0), repeats=repeats)
+    if 'train' in operations:
+        _record('train', train_batch_size, timing, train_steps)
+    # batched operations:
+    for batch_size in batch_sizes:
+        coord = flow.sample(batch_size)
+        if 'sample' in operations:
+            _record('sample', batch_size, time_function(lambda: flow.sample(batch_size), repeats), batch_size)
+        if 'log_probability' in operations:
+            _record('log_probability', batch_size, time_function(lambda: flow.log_probability(coord), repeats), batch_size)
+        if 'metric' in operations:
+            _record('metric', batch_size, time_function(lambda: flow.metric(coord), repeats), batch_size)
+        if 'levi_civita_connection' in operations:
+            _record('levi_civita_connection', batch_size, time_function(lambda: flow.levi_civita_connection(coord), repeats), batch_size)
+    # ODE solvers start from the mean of the chain:
+    y0 = flow.cast(chain.getMeans()[:dim])
+    if 'solve_eigenvalue_ode_abs' in operations:
+        y0_abs = flow.map_to_abstract_coord(tf.convert_to_tensor([y0]))[0]
+        _record('solve_eigenvalue_ode_abs', None, time_function(lambda: flow.solve_eigenvalue_ode_abs(y0_abs, 0, num_points=ode_points), repeats), ode_points)
+    if 'solve_KL_ode' in operations:
+        prior_chain = uniform_prior_chain(chain, n_samples=n_samples)
+        prior_flow = synthetic_probability.DiffFlowCallback(prior_chain, feedback=0, diagnostics_every=0)
+        prior_flow.train(epochs=1, batch_size=train_batch_size, steps_per_epoch=train_steps, verbose=0)
+        _record('solve_KL_ode', None, time_function(lambda: synthetic_probability.solve_KL_ode(flow, prior_flow, y0, 0, num_points=ode_points), repeats), ode_points)
+    if 'MAP_finder' in operations:
+        _record('MAP_finder', None, time_function(lambda: flow.MAP_finder(maxiter=MAP_maxiter, polish=False, seed=0), repeats), 1)
+    #
+    return results
+
+
+def run(dims=[2, 5, 10, 30], batch_sizes=[100, 1000, 10000], chains=['gaussian', 'banana'], operations=operations, outroot=None, feedback=1, **kwargs):
+    """
+    Run the benchmark suite and save the results.
+
+    :param dims: list of numbers of parameters.
+    :param batch_sizes: list of batch sizes.
+    :param chains: list of synthetic chains.
+    :param operations: list of operations to benchmark.
+    :param outroot: output file, defaults to ``results/benchmarks/<commit>.json``.
+    :param feedback: feedback level.
+    :param kwargs: passed to :func:`benchmark_flow`.
+    :return: dictionary with the environment and the results.
+    """
+    # initialize:
+    env = environment()
+    if outroot is None:
+        if not os.path.exists(out_folder):
+            os.makedirs(out_folder)
+        outroot = out_folder+env['commit']+('-dirty' if env['dirty'] else '')+'.json'
+    # run:
+    results = []
+    for chain_name in chains:
+        for dim in dims:
+            results += benchmark_flow(chain_name, dim, batch_sizes, operations=operations, feedback=feedback, **kwargs)
+    out = {'environment': env, 'results': results}
+    # save:
+    with open(outroot, 'w') as f:
+        json.dump(out, f, indent=1)
+    if feedback > 0:
+        print('* results saved in', outroot)
+    #
+    return out
+
+
+def compare(file_1, file_2, threshold=0.1):
+    """
+    Compare two benchmark files and print the ratio of median times.
+
+    :param file_1: reference results.
+    :param file_2: new results.
+    :param threshold: relative slow down that is flagged as a regression.
+    :return: list of tuples (key, reference median, new median, ratio).
+    """
+    def _load(file):
+        temp = json.load(open(file))['results']
+        return {(res['chain'], res['dim'], res['operation'], res['batch_size']): res['median'] for res in temp}
+    res_1, res_2 = _load(file_1), _load(file_2)
+    out = []
+    for key in sorted(set(res_1.keys()) & set(res_2.keys()), key=str):
+        ratio = res_2[key]/res_1[key]
+        out.append((key, res_1[key], res_2[key], ratio))
+        print('{:<8} dim={:<3} {:<26} batch={:<8} {:10.4g} s {:10.4g} s  x{:.2f}{}'.format(
+            *[str(k) for k in key], res_1[key], res_2[key], ratio, '  REGRESSION' if ratio > 1.+threshold else ''))
+    #
+    return out
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the flow operations on synthetic chains.')
+    parser.add_argument('--dims', type=int, nargs='+', default=[2, 5, 10, 30])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--chains', nargs='+', default=['gaussian', 'banana'], choices=list(chain_generators.keys()))
+    parser.add_argument('--operations', nargs='+', default=operations, choices=operations)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--output', default=None, help='output json file')
+    parser.add_argument('--compare', nargs=2, metavar=('REFERENCE', 'NEW'), help='compare two result files and exit')
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        compare(*args.compare)
+    else:
+        run(dims=args.dims, batch_sizes=args.batch_sizes, chains=args.chains, operations=args.operations,
+            outroot=args.output, repeats=args.repeats)
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+
+"""
+Build all paper figures and tables.
+
+The driver reads every ``paper_figure_*.py`` / ``paper_table_*.py`` script to find
+the example module it imports and the chains and flows it uses.
+It then works in two stages:
+
+1. each flow that is needed is trained (or loaded from its cache) exactly once,
+   independent flows in parallel;
+2. the figure scripts are run in parallel and read the cached flows.
+
+Figures whose inputs (the script, the local modules it imports and the chain
+files it uses) did not change since the last successful run are skipped.
+
+Usage::
+
+    python build_paper.py [-j N] [--force] [figure names ...]
+"""
+
+###############################################################################
+# initial imports:
+
+import os
+import ast
+import sys
+import glob
+import json
+import time
+import hashlib
+import argparse
+import importlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+###############################################################################
+# initial settings:
+
+here = os.path.dirname(os.path.abspath(__file__))
+# folder with the build logs and the stamps of the last successful runs:
+build_folder = os.path.join(here, 'results', 'paper_build')
+stamp_file = os.path.join(build_folder, 'stamps.json')
+# scripts that make up the paper:
+script_patterns = ['paper_figure_*.py', 'paper_table_*.py']
+
+###############################################################################
+# dependency analysis:
+
+
+def local_imports(script):
+    """
+    Local modules imported by a script, not including the transitive ones.
+
+    :param script: path of the python file.
+    :return: list of module names that have a file in the repository folder.
+    """
+    tree = ast.parse(open(script).read(), filename=script)
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module is not None and node.level == 0:
+            names.append(node.module)
+    names = [name.split('.')[0] for name in names]
+    #
+    return sorted(set([name for name in names if os.path.isfile(os.path.join(here, name+'.py'))]))
+
+
+def module_closure(script):
+    """
+    All local source files a script depends on, following imports recursively.
+
+    :param script: path of the python file.
+    :return: sorted list of file paths, including the script.
+    """
+    files, todo = set(), [os.path.abspath(script)]
+    while len(todo) > 0:
+        temp = todo.pop()
+        if temp in files:
+            continue
+        files.add(temp)
+        todo += [os.path.join(here, name+'.py') for name in local_imports(temp)]
+    #
+    return sorted(files)
+
+
+def example_usage(script):
+    """
+    Example module used by a figure script and the attributes it accesses.
+
+    :param script: path of the python file.
+    :return: tuple with the example module name (or None) and the sorted list of attributes.
+    """
+    tree = ast.parse(open(script).read(), filename=script)
+    module = None
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.asname == 'example':
+                    module = alias.name
+    if module is None:
+        return None, []
+    attributes = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == 'example':
+            attributes.add(node.attr)
+    #
+    return module, sorted(attributes)
+
+
+def is_lazy(module):
+    """
+    Whether an example module defines its chains and flows lazily,
+    through ``DES_generate.lazy_example``. Checked on the source, since
+    importing the other example modules trains their flows.
+
+    :param module: name of the example module.
+    :return: True or False.
+    """
+    file = os.path.join(here, module+'.py')
+    if not os.path.isfile(file):
+        return False
+    tree = ast.parse(open(file).read(), filename=file)
+    #
+    return any(isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == '_flows' for t in node.targets)
+               for node in tree.body)
+
+
+def flow_jobs(module, attributes):
+    """
+    Flows to prepare for an example module.
+
+    Lazy example modules (see ``DES_generate.lazy_example``) define ``_flows``,
+    for those one job per prior/posterior pair is returned.
+    Other example modules train their flows at import, and are prepared by importing them once.
+
+    :param module: name of the example module.
+    :param attributes: attributes of the module used by the figures.
+    :return: dictionary of job names and python statements that build the flows.
+    """
+    if not is_lazy(module):
+        return {module: 'import {0}'.format(module)}
+    flows = importlib.import_module(module)._flows
+    jobs = {}
+    for name, (_, _, _, log_name, _) in flows.items():
+        used = [name+'_prior_flow', name+'_posterior_flow']
+        if log_name is not None:
+            used += [log_name+'_prior_flow', log_name+'_posterior_flow']
+        if any(att in attributes for att in used):
+            jobs[module+'.'+name] = 'import {0}; {0}.{1}_posterior_flow'.format(module, name)
+    #
+    return jobs
+
+
+def chain_files(module, attributes):
+    """
+    Chain files read by a lazy example module for the given attributes.
+
+    :param module: name of the example module.
+    :param attributes: attributes of the module used by a figure.
+    :return: sorted list of chain file paths.
+    """
+    temp = importlib.import_module(module)
+    chain_roots, flows = getattr(temp, '_chain_roots', {}), getattr(temp, '_flows', {})
+    chains = set([att for att in attributes if att in chain_roots])
+    if 'chains' in attributes:
+        chains.update(chain_roots.keys())
+    # chains used to train the flows:
+    for name, (prior, posterior, _, log_name, _) in flows.items():
+        prefixes = [name] + ([log_name] if log_name is not None else [])
+        if any(att in [pre+'_prior_flow' for pre in prefixes]+[pre+'_posterior_flow' for pre in prefixes] for att in attributes):
+            chains.update([prior, posterior])
+    import DES_generate
+    files = []
+    for chain in chains:
+        files += glob.glob(os.path.join(DES_generate.chains_dir, chain_roots[chain]+'*'))
+    #
+    return sorted(files)
+
+
+def input_stamp(files):
+    """
+    Hash of the content of a list of files.
+    """
+    temp = hashlib.sha256()
+    for file in files:
+        temp.update(file.encode())
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                temp.update(chunk)
+    #
+    return temp.hexdigest()
+
+###############################################################################
+# job running:
+
+
+def run_job(name, command, log_file):
+    """
+    Run a python command in a separate process, saving its output in a log file.
+
+    :param name: name of the job.
+    :param command: list of arguments for the python interpreter.
+    :param log_file: file where stdout and stderr are written.
+    :return: tuple with the job name, the return code and the wall time.
+    """
+    t0 = time.time()
+    with open(log_file, 'w') as f:
+        ret = subprocess.call([sys.executable]+command, cwd=here, stdout=f, stderr=subprocess.STDOUT)
+    #
+    return name, ret, time.time()-t0
+
+
+def run_pool(jobs, num_workers, feedback=1):
+    """
+    Run a dictionary of jobs over a pool of worker processes.
+
+    :param jobs: dictionary of job names and tuples (command, log file).
+    :param num_workers: number of jobs running at the same time.
+    :param feedback: feedback level.
+    :return: dictionary of job names and return codes.
+    """
+    results = {}
+    # every job is its own python process, threads only wait for them:
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(run_job, name, command, log_file) for name, (command, log_file) in jobs.items()]
+        for future in as_completed(futures):
+            name, ret, wall = future.result()
+            results[name] = ret
+            if feedback > 0:
+                print('  {:<40} {:>8} {:8.1f} s'.format(name, 'ok' if ret == 0 else 'FAILED', wall))
+    #
+    return results
+
+###############################################################################
+# main driver:
+
+
+def build(figures=None, num_workers=None, force=False, feedback=1):
+    """
+    Build the paper figures.
+
+    :param figures: list of script names to build, defaults to all paper scripts.
+    :param num_workers: number of parallel jobs, defaults to the number of cpus.
+    :param force: rebuild figures even if their inputs did not change.
+    :param feedback: feedback level.
+    :return: dictionary of figure names and return codes of the figures that were run.
+    """
+    # initialize:
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    # the example modules use paths relative to the repository folder:
+    os.chdir(here)
+    if not os.path.exists(build_folder):
+        os.makedirs(build_folder)
+    # output folder shared by the figures, created here to avoid races between them:
+    if not os.path.exists(os.path.join(here, 'results', 'paper_plots')):
+        os.makedirs(os.path.join(here, 'results', 'paper_plots'))
+    sys.path.insert(0, here)
+    # collect the scripts:
+    scripts = sorted(set(sum([glob.glob(os.path.join(here, pattern)) for pattern in script_patterns], [])))
+    if figures is not None and len(figures) > 0:
+        figures = [os.path.splitext(os.path.basename(fig))[0] for fig in figures]
+        scripts = [script for script in scripts if os.path.splitext(os.path.basename(script))[0] in figures]
+    # load stamps:
+    stamps = {}
+    if os.path.isfile(stamp_file):
+        stamps = json.load(open(stamp_file))
+    # find what each figure needs and whether it changed:
+    todo, needs = {}, {}
+    for script in scripts:
+        name = os.path.splitext(os.path.basename(script))[0]
+        module, attributes = example_usage(script)
+        files = module_closure(script)
+        if module is not None and is_lazy(module):
+            files += chain_files(module, attributes)
+        stamp = input_stamp(files)
+        if not force and stamps.get(name, None) == stamp:
+            if feedback > 0:
+                print('* skipping', name, '(inputs unchanged)')
+            continue
+        todo[name] = (script, stamp)
+        needs[name] = (module, attributes)
+    if len(todo) == 0:
+        if feedback > 0:
+            print('* nothing to do')
+        return {}
+    # stage 1, train or load every needed flow once:
+    jobs = {}
+    for module, attributes in needs.values():
+        if module is None or not os.path.isfile(os.path.join(here, module+'.py')):
+            continue
+        for job, statement in flow_jobs(module, attributes).items():
+            jobs[job] = (['-c', statement], os.path.join(build_folder, 'flow_'+job+'.log'))
+    if len(jobs) > 0:
+        if feedback > 0:
+            print('* preparing', len(jobs), 'flows with', num_workers, 'workers')
+        results = run_pool(jobs, num_workers, feedback)
+        failed = [job for job, ret in results.items() if ret != 0]
+        if len(failed) > 0:
+            raise RuntimeError('Failed to prepare flows: '+', '.join(sorted(failed))+'. See the logs in '+build_folder)
+    # stage 2, run the figures:
+    if feedback > 0:
+        print('* building', len(todo), 'figures with', num_workers, 'workers')
+    jobs = {name: ([script], os.path.join(build_folder, name+'.log')) for name, (script, _) in todo.items()}
+    results = run_pool(jobs, num_workers, feedback)
+    # save stamps of the figures that succeeded:
+    for name, ret in results.items():
+        if ret == 0:
+            stamps[name] = todo[name][1]
+        else:
+            stamps.pop(name, None)
+    with open(stamp_file, 'w') as f:
+        json.dump(stamps, f, indent=1, sort_keys=True)
+    #
+    return results
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Build the paper figures and tables.')
+    parser.add_argument('figures', nargs='*', help='scripts to build, defaults to all paper scripts')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of parallel jobs')
+    parser.add_argument('--force', action='store_true', help='rebuild even if inputs are unchanged')
+    args = parser.parse_args()
+
+    results = build(args.figures, num_workers=args.jobs, force=args.force)
+    if any(ret != 0 for ret in results.values()):
+        sys.exit(1)
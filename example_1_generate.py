@@ -130,6 +130,10 @@ else:
     # save out:
     pickle.dump(temp, open(flow_cache+'/posterior_MAP.pickle', 'wb'))
 
+# keep the sample pools of the flows in the cache:
+prior_flow.sample_pool_dir = flow_cache
+posterior_flow.sample_pool_dir = flow_cache
+
 ###############################################################################
 # test plot if called directly:
 if __name__ == '__main__':
@@ -148,10 +152,10 @@ if __name__ == '__main__':
 
     # plot learned posterior distribution:
     g = plots.get_subplot_plotter()
-    g.triangle_plot([posterior_chain, posterior_flow.MCSamples(n_samples)], filled=True, markers=posterior_flow.MAP_coord)
+    g.triangle_plot([posterior_chain, posterior_flow.MCSamples(n_samples, use_pool=True)], filled=True, markers=posterior_flow.MAP_coord)
     g.export(out_folder+'0_learned_posterior_distribution.pdf')
 
     # plot learned prior distribution:
     g = plots.get_subplot_plotter()
-    g.triangle_plot([prior_chain, prior_flow.MCSamples(n_samples)], filled=True)
+    g.triangle_plot([prior_chain, prior_flow.MCSamples(n_samples, use_pool=True)], filled=True)
     g.export(out_folder+'0_learned_prior_distribution.pdf')
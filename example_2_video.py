@@ -123,8 +123,7 @@ for ind in range(110):
         ax2.plot(origin[0]+_length*np.sin(theta), origin[1]+_length*np.cos(theta), ls='-', lw=1., color='k')
 
     # compute flow probability on a grid:
-    log_P = posterior_flow.log_probability(np.array([X, Y], dtype=np.float32).T)
-    log_P = np.array(log_P).T
+    log_P = posterior_flow.grid_evaluation(x, y, cache=False)['log_probability']
     P = np.exp(log_P)
     P = P / simps(simps(P, y), x)
     ax1.contour(X, Y, P, analyze_2d_example.get_levels(P, x, y, levels), linewidths=1., linestyles='--', colors=['red' for i in levels])
@@ -37,25 +37,15 @@ if not os.path.exists(out_folder):
 ###############################################################################
 # import chains:
 
-prior_chain = getdist.mcsamples.loadMCSamples(file_root=DES_generate.chains_dir+'001_DESY1_3x2_prior', no_cache=True, settings=DES_generate.settings)
-posterior_chain = getdist.mcsamples.loadMCSamples(file_root=DES_generate.chains_dir+'001_DESY1_3x2', no_cache=True, settings=DES_generate.settings)
-
-###############################################################################
-# process chains:
+param_names = ['omegam', 'sigma8', 'omegab', 'H0', 'ns']
 
-# add log parameters:
-for ch in [prior_chain, posterior_chain]:
-    temp_names = ch.getParamNames().list()
-    for name in temp_names:
-        if np.all(ch.samples[:, ch.index[name]] > 0.):
-            ch.addDerived(np.log(ch.samples[:, ch.index[name]]), name='log_'+name, label='\\log '+ch.getParamNames().parWithName(name).label)
-    # update after adding all parameters:
-    ch.updateBaseStatistics()
+# only the flow parameters, and their log, are read from the binary copies of the chains:
+prior_chain = DES_generate.load_chain('001_DESY1_3x2_prior', param_names=param_names)
+posterior_chain = DES_generate.load_chain('001_DESY1_3x2', param_names=param_names)
 
 ###############################################################################
 # train the relevant flows:
 
-param_names = ['omegam', 'sigma8', 'omegab', 'H0', 'ns']
 params_flow_cache = out_folder+'params_flow_cache'
 temp = DES_generate.helper_load_chains(param_names, prior_chain, posterior_chain, params_flow_cache)
 params_prior_flow, params_posterior_flow = temp
@@ -75,17 +65,17 @@ if __name__ == '__main__':
     # prior and posterior chain:
     g = plots.get_subplot_plotter()
     g.triangle_plot([prior_chain,
-                     log_params_prior_flow.MCSamples(num_samples),
+                     log_params_prior_flow.MCSamples(num_samples, use_pool=True),
                      posterior_chain,
-                     log_params_posterior_flow.MCSamples(num_samples)],
+                     log_params_posterior_flow.MCSamples(num_samples, use_pool=True)],
                     params=log_param_names, filled=False)
     g.export(out_folder+'/0_sample_prior_posterior_distribution_log.pdf')
 
     g = plots.get_subplot_plotter()
     g.triangle_plot([prior_chain,
-                     params_prior_flow.MCSamples(num_samples),
+                     params_prior_flow.MCSamples(num_samples, use_pool=True),
                      posterior_chain,
-                     params_posterior_flow.MCSamples(num_samples)],
+                     params_posterior_flow.MCSamples(num_samples, use_pool=True)],
                     params=param_names, filled=False)
     g.export(out_folder+'/0_sample_prior_posterior_distribution.pdf')
 
@@ -25,9 +25,11 @@ import tensorflow_probability as tfp
 tfb = tfp.bijectors
 tfd = tfp.distributions
 #flow.cop
-from scipy import optimize
 from scipy.integrate import simps
 
+# helper function to get levels:
+from utilities import get_levels
+
 import synthetic_probability
 import importlib
 importlib.reload(synthetic_probability)
@@ -68,21 +70,6 @@ Y_chain = MCSamples(samples=Y_sample, names=param_names, label='Transformed dist
 g = plots.get_subplot_plotter()
 g.triangle_plot([chain, flow_chain, Y_chain], params=param_names, filled=False)
 
-def get_levels(P, x, y, conf=[0.95, 0.68]):
-    """
-    Get levels from a 2D grid
-    """
-    def _helper(alpha):
-        _P = P.copy()
-        _P[_P < alpha] = 0.
-        return simps(simps(_P, y), x)
-    levs = []
-    for c in conf:
-        res = optimize.brentq(lambda x: _helper(x)-c, np.amin(P), np.amax(P))
-        levs.append(res)
-    #
-    return levs
-
 # find maximum posterior:
 
 # MAP:
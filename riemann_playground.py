@@ -73,6 +73,10 @@ assert np.allclose(tf.einsum("...ij->...ji", metric), metric)  # metric is symme
 assert np.allclose(tf.einsum("...ij->...ji", inv_metric), inv_metric)  # inverse metric is symmetric
 # derivative of the metric:
 d_metric = self.coord_metric_derivative(coord)
+with tf.GradientTape(watch_accessed_variables=False) as tape:
+    tape.watch(coord)
+    temp_metric = self.metric(coord)
+assert np.allclose(d_metric, tape.batch_jacobian(temp_metric, coord), atol=1.e-4)  # metric derivative from the connection
 d_metric = tf.einsum("...ijk->...kij", d_metric)
 dinv_metric = self.coord_inverse_metric_derivative(coord)
 dinv_metric = tf.einsum("...ijk->...kij", dinv_metric)
@@ -158,5 +162,24 @@ ricci
 
 ricci_scalar
 
+###############################################################################
+# geodesics for a metric that is not the one of the flow:
+
+posterior_flow, prior_flow = example.posterior_flow, example.prior_flow
+pos_start = posterior_flow.cast(posterior_flow.sample(10))
+pos_end = posterior_flow.cast(posterior_flow.sample(10))
+solution_times = posterior_flow.cast(np.linspace(0., 1., 20))
+
+# connection built from the metric agrees with the one of the flow:
+connection = posterior_flow.metric_connection(posterior_flow.metric)
+assert np.allclose(connection(pos_start), posterior_flow.levi_civita_connection(pos_start), atol=1.e-4)
+# for a metric that includes the prior the straight line in abstract space is not a geodesic and the refinement moves it:
+assert posterior_flow.metric_connection(posterior_flow.metric) is connection  # connections are cached for each metric
+connection = posterior_flow.metric_connection(lambda x: posterior_flow.metric(x) + prior_flow.metric(x))
+traj_0, _ = posterior_flow.fast_geodesic_bvp(pos_start, pos_end, solution_times)
+traj_1, _ = posterior_flow.refine_geodesic_bvp(pos_start, pos_end, solution_times, connection)
+assert np.allclose(traj_1[:, -1, :], pos_end, atol=1.e-3)  # end points are matched
+assert not np.allclose(traj_0, traj_1, atol=1.e-3)  # refined paths differ from the initial guess
+
 
 pass
@@ -13,7 +13,13 @@ self = Callback()
 ###############################################################################
 # initial imports and set-up:
 
+import os
 import copy
+import time
+import json
+import hashlib
+import contextlib
+import warnings
 import numpy as np
 import getdist.chains as gchains
 gchains.print_load_details = False
@@ -23,9 +29,15 @@ import scipy.integrate
 from scipy.linalg import sqrtm
 from scipy.integrate import simps
 from scipy.spatial import cKDTree
+from scipy.spatial.distance import cdist
 from scipy.optimize import differential_evolution, minimize
 import scipy.stats
+import scipy.special
 import pickle
+import itertools
+import functools
+import multiprocessing
+import concurrent.futures
 from collections.abc import Iterable
 import matplotlib
 from matplotlib import pyplot as plt
@@ -169,7 +181,7 @@ class SimpleMAF(object):
         return maf
 
 
-def prior_bijector_helper(prior_dict_list=None, name=None, loc=None, cov=None, **kwargs):
+def prior_bijector_helper(prior_dict_list=None, name=None, loc=None, cov=None, dtype=None, **kwargs):
     """
     Example usage
 
@@ -185,14 +197,19 @@ def prior_bijector_helper(prior_dict_list=None, name=None, loc=None, cov=None, *
     diff = DiffFlowCallback(chain, trainable_bijector=prior, Y2X_is_identity=True)
 
     """
+    # precision of the bijector, defaults to the module precision:
+    if dtype is None:
+        dtype = prec
+    _np_prec = tf.as_dtype(dtype).as_numpy_dtype
+
     def uniform(a, b):
-        return tfb.Chain([tfb.Shift(np_prec((a+b)/2)), tfb.Scale(np_prec(b-a)), tfb.Shift(-0.5), tfb.NormalCDF()])
+        return tfb.Chain([tfb.Shift(_np_prec((a+b)/2)), tfb.Scale(_np_prec(b-a)), tfb.Shift(_np_prec(-0.5)), tfb.NormalCDF()])
 
     def normal(mu, sig):
-        return tfb.Chain([tfb.Shift(np_prec(mu)), tfb.Scale(np_prec(sig))])
+        return tfb.Chain([tfb.Shift(_np_prec(mu)), tfb.Scale(_np_prec(sig))])
 
     def multivariate_normal(loc, cov):
-        return tfd.MultivariateNormalTriL(loc=loc.astype(np_prec), scale_tril=tf.linalg.cholesky(cov.astype(np_prec))).bijector
+        return tfd.MultivariateNormalTriL(loc=np.asarray(loc).astype(_np_prec), scale_tril=tf.linalg.cholesky(np.asarray(cov).astype(_np_prec))).bijector
 
     if prior_dict_list is not None: # Mix of uniform and gaussian one-dimensional priors
 
@@ -220,6 +237,497 @@ def prior_bijector_helper(prior_dict_list=None, name=None, loc=None, cov=None, *
     else:
         raise ValueError
 
+###############################################################################
+# batched ODE helpers:
+
+
+def _fixed_step_rk4(rhs, state, carry, solution_times, num_substeps=1):
+    """
+    Fixed step RK4 integrator for a batch of ODEs. Has to be called inside a :func:`tf.function`, the time loop is a :func:`tf.while_loop`.
+
+    The right hand side is called as `rhs(state, carry)` and has to return `(state_dot, new_carry)`. The carry is kept fixed during a step and is updated at the end of each step, so that it can be used to hold the reference direction of eigenvector flows. Trajectories for which a step is not finite are frozen at their last good value.
+
+    :param rhs: right hand side of the ODE.
+    :param state: initial state, with shape (N, D).
+    :param carry: initial carry, with shape (N, C).
+    :param solution_times: output times, the first one is the initial time.
+    :param num_substeps: number of RK4 steps between two output times, defaults to 1.
+    :type num_substeps: int, optional
+    :return: states, state derivatives and carries at the output times, with shape (T, N, ...).
+    """
+    num_times = tf.shape(solution_times)[0]
+    # initial derivative:
+    state_dot, carry = rhs(state, carry)
+    # initialize outputs:
+    states = tf.TensorArray(state.dtype, size=num_times).write(0, state)
+    state_dots = tf.TensorArray(state.dtype, size=num_times).write(0, state_dot)
+    carries = tf.TensorArray(carry.dtype, size=num_times).write(0, carry)
+
+    def _body(i, state, state_dot, carry, states, state_dots, carries):
+        h = (solution_times[i] - solution_times[i-1]) / num_substeps
+        for _ in range(num_substeps):
+            # RK4 step, the first stage is the derivative at the end of the previous step:
+            k1 = state_dot
+            k2, _ = rhs(state + 0.5*h*k1, carry)
+            k3, _ = rhs(state + 0.5*h*k2, carry)
+            k4, _ = rhs(state + h*k3, carry)
+            new_state = state + h/6.*(k1 + 2.*k2 + 2.*k3 + k4)
+            new_state_dot, new_carry = rhs(new_state, carry)
+            # freeze the trajectories that failed:
+            ok = tf.math.logical_and(tf.reduce_all(tf.math.is_finite(new_state), axis=-1),
+                                     tf.reduce_all(tf.math.is_finite(new_state_dot), axis=-1))
+            state = tf.where(ok[:, None], new_state, state)
+            state_dot = tf.where(ok[:, None], new_state_dot, state_dot)
+            carry = tf.where(ok[:, None], new_carry, carry)
+        return i+1, state, state_dot, carry, states.write(i, state), state_dots.write(i, state_dot), carries.write(i, carry)
+
+    _, _, _, _, states, state_dots, carries = tf.while_loop(lambda i, *args: i < num_times, _body,
+                                                            (tf.constant(1), state, state_dot, carry, states, state_dots, carries))
+    #
+    return states.stack(), state_dots.stack(), carries.stack()
+
+
+def _patch_two_sided_solution(solution_times, traj, vel, side, aux=None):
+    """
+    Patch together the solutions of a batch of forward and backward integrations.
+    The first half of the batch in `traj` and `vel` (with shape (N, T, D)) is the '+' side and the second half is the '-' side, unless only one side is integrated.
+    Optional auxiliary arrays, like eigenvalues, are patched in the same way but are not flipped in sign.
+    """
+    solution_times = np.asarray(solution_times)
+    if side == '+':
+        times = solution_times
+    elif side == '-':
+        times = -solution_times[::-1]
+        traj, vel = traj[:, ::-1], -vel[:, ::-1]
+        if aux is not None:
+            aux = aux[:, ::-1]
+    else:
+        # patch solutions:
+        num = traj.shape[0] // 2
+        times = np.concatenate((-solution_times[::-1], solution_times[1:]))
+        traj = np.concatenate((traj[num:, :0:-1], traj[:num]), axis=1)
+        vel = np.concatenate((-vel[num:, :0:-1], vel[:num]), axis=1)
+        if aux is not None:
+            aux = np.concatenate((aux[num:, :0:-1], aux[:num]), axis=1)
+    #
+    if aux is not None:
+        return times, traj, vel, aux
+    return times, traj, vel
+
+###############################################################################
+# helpers for streaming chains:
+
+
+# chunk index of text chains, see :func:`_text_chunk_index`:
+_text_index_cache = {}
+
+
+def _text_chunk_index(files, chunk_size, ignore_rows=0):
+    """
+    Byte offsets and number of rows of the chunks of one or more getdist chain text files, so that chunks can be read in any order.
+    The first rows of each file are removed as burn in, following the getdist convention for `ignore_rows`: a fraction of the rows if smaller than one, a number of rows otherwise.
+    The index is cached as long as the files do not change.
+    """
+    key = (tuple(files), chunk_size, ignore_rows, tuple(os.path.getmtime(file) for file in files))
+    if key not in _text_index_cache:
+        index = []
+        for file in files:
+            # count rows:
+            with open(file, 'rb') as f:
+                num_rows = sum(1 for line in f if line.strip() and not line.startswith(b'#'))
+            skip = int(ignore_rows*num_rows) if ignore_rows < 1 else int(ignore_rows)
+            # offsets of the chunks after burn in:
+            with open(file, 'rb') as f:
+                row = 0
+                while True:
+                    offset = f.tell()
+                    line = f.readline()
+                    if not line:
+                        break
+                    if not line.strip() or line.startswith(b'#'):
+                        continue
+                    if row >= skip and (row - skip) % chunk_size == 0:
+                        index.append((file, offset, min(chunk_size, num_rows - row)))
+                    row += 1
+        _text_index_cache[key] = index
+    #
+    return _text_index_cache[key]
+
+
+def _chain_chunks(source, ind, chunk_size, shuffle=False, ignore_rows=0):
+    """
+    Iterate over chunks of rows of a chain, returning the chunk index, the samples of the parameters with indexes `ind`, the weights and the log likes (None if not available).
+    The source is either a tuple of (possibly memory-mapped) samples, weights and, optionally, log likes, the path of a `.npy` file or one or more getdist chain text files. Files have the getdist column layout (weight, minus log likelihood, parameters).
+    Samples in a tuple can be a 2D array or a list of 1D columns, for example the memory-mapped columns of a columnar chain.
+    Burn in, see :func:`_text_chunk_index`, is removed from text files only.
+    If `shuffle` is True the order of the chunks is randomized. The chunk index does not depend on the order.
+    """
+    # text files:
+    if isinstance(source, str) and not source.endswith('.npy'):
+        source = [source]
+    if isinstance(source, list):
+        index = _text_chunk_index(source, chunk_size, ignore_rows=ignore_rows)
+        order = np.random.permutation(len(index)) if shuffle else np.arange(len(index))
+        for i in order:
+            file, offset, num_rows = index[i]
+            with open(file, 'rb') as f:
+                f.seek(offset)
+                lines = []
+                while len(lines) < num_rows:
+                    line = f.readline()
+                    if line.strip() and not line.startswith(b'#'):
+                        lines.append(line.decode())
+            temp = np.loadtxt(lines, ndmin=2)
+            yield i, temp[:, 2:][:, ind], temp[:, 0], temp[:, 1]
+        return
+    # arrays:
+    loglikes = None
+    if isinstance(source, str):
+        temp = np.load(source, mmap_mode='r')
+        samples, weights, loglikes, offset = temp, temp[:, 0], temp[:, 1], 2
+    else:
+        samples, weights = source[0], source[1]
+        if len(source) > 2:
+            loglikes = source[2]
+        offset = 0
+    columnar = isinstance(samples, (list, tuple))
+    num_rows = len(samples[0]) if columnar else samples.shape[0]
+    if weights is None:
+        weights = np.ones(num_rows)
+    num_chunks = int(np.ceil(num_rows / chunk_size))
+    order = np.random.permutation(num_chunks) if shuffle else np.arange(num_chunks)
+    col = [offset + j for j in ind]
+    for i in order:
+        rows = slice(i*chunk_size, (i+1)*chunk_size)
+        if columnar:
+            temp = np.stack([np.asarray(samples[j][rows]) for j in ind], axis=1)
+        else:
+            temp = np.asarray(samples[rows])[:, col]
+        yield i, temp, np.array(weights[rows], dtype=np.float64), None if loglikes is None else np.array(loglikes[rows], dtype=np.float64)
+
+###############################################################################
+# helpers for parallel training:
+
+
+# chain of the population, sent once to each worker process:
+_population_chain = None
+
+
+def _population_worker_init(num_threads, chain):
+    """
+    Limit the number of threads of each training process so that workers do not compete for cores, and store the chain shared by all the replicas of the worker.
+    """
+    global _population_chain
+    tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(num_threads)
+    _population_chain = chain
+
+
+def _population_worker(init_kwargs, train_kwargs, seed):
+    """
+    Train one member of the population of :meth:`DiffFlowCallback.parallel_global_train` on a replica of the flow.
+    """
+    np.random.seed(seed)
+    tf.random.set_seed(seed)
+    flow = DiffFlowCallback(_population_chain, feedback=0, **init_kwargs)
+    history = flow.train(**train_kwargs)
+    #
+    return flow.model.get_weights(), history.history['loss'][-1], history.history['val_loss'][-1], flow.log
+
+###############################################################################
+# compiled flow methods:
+
+
+def _function_identity(function):
+    """
+    Key that identifies what a python function computes, rather than the function object.
+    Functions defined by the same code, that refer to the same objects (closure variables, globals and defaults), get the same key, so that for example two lambdas created by the same line or two accesses to a compiled method of the same flow match.
+    Objects are compared by identity, the caller has to keep `function` alive while the key is in use.
+    """
+    code = getattr(function, '__code__', None)
+    if code is None:
+        return id(function)
+    cells = tuple(id(cell.cell_contents) for cell in (function.__closure__ or ()))
+    names = tuple(id(function.__globals__[name]) for name in code.co_names if name in function.__globals__)
+    defaults = tuple(id(value) for value in (function.__defaults__ or ()))
+    #
+    return (code, cells, names, defaults)
+
+
+class _flow_function(object):
+    """
+    Decorator for the compiled methods of :class:`~.DiffFlowCallback`.
+
+    Works like :func:`tf.function` but each flow gets its own compiled function, with an input signature built from the flow precision and number of parameters and a dynamic batch dimension, so that the function is traced once per flow.
+    Inputs are canonicalized before the call: coordinates (spec 'coord') are cast to the flow precision and arrays with any number of leading batch dimensions (including a single point) are flattened to shape (N, D), with the leading dimensions restored in the output.
+    Integers (spec 'int') are cast to int32 and vectors of times (spec 'times') to the flow precision.
+    Arguments after the ones with a spec are python options, like a number of steps or a function, and a function is compiled for each combination of their values.
+    See :meth:`DiffFlowCallback.tracing_report` for the number of traces.
+
+    :param specs: one spec for each argument, 'coord', 'int' or 'times'.
+    """
+
+    def __init__(self, *specs):
+        self.specs = specs
+
+    def __call__(self, function):
+        self.function = function
+        self.name = function.__name__
+        code = function.__code__
+        self.arg_names = code.co_varnames[1:1+len(self.specs)]
+        self.option_names = code.co_varnames[1+len(self.specs):code.co_argcount]
+        self.__doc__ = function.__doc__
+        #
+        return self
+
+    def compiled(self, flow, options={}):
+        """
+        Get (and build on first call) the compiled function of a flow, for the given values of the options.
+        """
+        functions = flow.__dict__.setdefault('_compiled_functions', {})
+        key = self.name if len(options) == 0 else (self.name,)+tuple(sorted(options.items()))
+        if key not in functions:
+            signature = []
+            for spec in self.specs:
+                if spec == 'coord':
+                    signature.append(tf.TensorSpec(shape=[None, flow.num_params], dtype=flow.prec))
+                elif spec == 'times':
+                    signature.append(tf.TensorSpec(shape=[None], dtype=flow.prec))
+                else:
+                    signature.append(tf.TensorSpec(shape=[], dtype=tf.int32))
+            function = self.function.__get__(flow, type(flow))
+            if len(options) > 0:
+                function = functools.partial(function, **options)
+            functions[key] = tf.function(function, input_signature=signature)
+        #
+        return functions[key]
+
+    def __get__(self, flow, owner):
+        if flow is None:
+            return self
+        specs, arg_names, option_names = self.specs, self.arg_names, self.option_names
+
+        def _canonical(*args, **kwargs):
+            args = list(args) + [kwargs.pop(name) for name in arg_names[len(args):] if name in kwargs]
+            # python options:
+            options = dict(zip(option_names, args[len(specs):]))
+            args = args[:len(specs)]
+            for name in option_names:
+                if name in kwargs:
+                    options[name] = kwargs.pop(name)
+            if len(kwargs) > 0:
+                raise TypeError('{}() got unexpected arguments {}'.format(self.name, list(kwargs.keys())))
+            batch_shape = None
+            for i, spec in enumerate(specs):
+                if spec == 'coord':
+                    args[i] = tf.cast(args[i], flow.prec)
+                    if args[i].shape.rank != 2:
+                        batch_shape = tf.shape(args[i])[:-1]
+                        args[i] = tf.reshape(args[i], [-1, flow.num_params])
+                elif spec == 'times':
+                    args[i] = tf.cast(args[i], flow.prec)
+                else:
+                    args[i] = tf.cast(args[i], tf.int32)
+            out = self.compiled(flow, options)(*args)
+            # restore the batch dimensions:
+            if batch_shape is not None:
+                out = tf.nest.map_structure(lambda x: tf.reshape(x, tf.concat([batch_shape, tf.shape(x)[1:]], axis=0)), out)
+            #
+            return out
+        _canonical.__name__ = self.name
+        _canonical.__doc__ = self.__doc__
+        #
+        return _canonical
+
+###############################################################################
+# profiling:
+
+
+class FlowProfiler(object):
+    """
+    Records wall time, number of calls and batch sizes of the methods and training stages of a :class:`~.DiffFlowCallback`.
+    Times are inclusive: a method that calls another profiled method is charged for both.
+    Calls made while tracing a :func:`tf.function` are not recorded.
+
+    Stages listed in `trace_stages` are also annotated with :class:`tf.profiler.experimental.Trace`, and show up in TensorBoard when a profiler session is running (see `logdir`).
+
+    :param trace_stages: list of stage names to annotate for the tensorflow profiler, 'all' for all stages, defaults to None.
+    :type trace_stages: list, optional
+    :param logdir: if given a tensorflow profiler session writing to this directory is started with :meth:`start_trace`, defaults to None.
+    :type logdir: str, optional
+    """
+
+    def __init__(self, trace_stages=None, logdir=None):
+        self.trace_stages = trace_stages if trace_stages == 'all' else set(trace_stages if trace_stages is not None else [])
+        self.logdir = logdir
+        self.records = {}
+        self._tracing = False
+        self._t_start = time.perf_counter()
+
+    def reset(self):
+        """
+        Remove all records and restart the clock.
+        """
+        self.records = {}
+        self._t_start = time.perf_counter()
+
+    def add(self, name, wall_time, batch_size=None):
+        """
+        Add a record to a stage.
+
+        :param name: name of the stage.
+        :param wall_time: wall time in seconds.
+        :param batch_size: number of samples processed, defaults to None.
+        """
+        record = self.records.setdefault(name, {'calls': 0, 'total_time': 0., 'min_time': np.inf, 'max_time': 0., 'samples': 0, 'batch_sizes': set()})
+        record['calls'] += 1
+        record['total_time'] += wall_time
+        record['min_time'] = min(record['min_time'], wall_time)
+        record['max_time'] = max(record['max_time'], wall_time)
+        if batch_size is not None:
+            record['samples'] += int(batch_size)
+            record['batch_sizes'].add(int(batch_size))
+
+    @contextlib.contextmanager
+    def stage(self, name, batch_size=None):
+        """
+        Context manager that times a stage.
+
+        :param name: name of the stage.
+        :param batch_size: number of samples processed, defaults to None.
+        """
+        trace = None
+        if self.trace_stages == 'all' or name in self.trace_stages:
+            trace = tf.profiler.experimental.Trace(name)
+            trace.__enter__()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter()-t0, batch_size)
+            if trace is not None:
+                trace.__exit__(None, None, None)
+
+    def start_trace(self):
+        """
+        Start the tensorflow profiler session writing to `logdir`.
+        """
+        if self.logdir is not None and not self._tracing:
+            tf.profiler.experimental.start(self.logdir)
+            self._tracing = True
+
+    def stop_trace(self):
+        """
+        Stop the tensorflow profiler session, if running.
+        """
+        if self._tracing:
+            tf.profiler.experimental.stop()
+            self._tracing = False
+
+    def report(self):
+        """
+        Structured report of the records.
+
+        :return: dictionary with, for each stage, number of calls, total, mean, min and max wall time, fraction of the time elapsed since the profiler was created (or reset), number of samples processed and batch sizes seen.
+        """
+        elapsed = time.perf_counter() - self._t_start
+        out = {}
+        for name, record in sorted(self.records.items(), key=lambda x: -x[1]['total_time']):
+            out[name] = {'calls': record['calls'],
+                         'total_time': record['total_time'],
+                         'mean_time': record['total_time']/record['calls'],
+                         'min_time': record['min_time'],
+                         'max_time': record['max_time'],
+                         'fraction': record['total_time']/elapsed,
+                         'samples': record['samples'],
+                         'samples_per_second': record['samples']/record['total_time'] if record['total_time'] > 0. and len(record['batch_sizes']) > 0 else None,
+                         'batch_sizes': sorted(record['batch_sizes']),
+                         }
+        #
+        return out
+
+    def save(self, path):
+        """
+        Save the report in json format.
+
+        :param path: output file.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+
+    def print_report(self):
+        """
+        Print the report as a table, sorted by total time.
+        """
+        print('{:<40} {:>8} {:>12} {:>12} {:>8}'.format('stage', 'calls', 'total [s]', 'mean [s]', 'samples'))
+        for name, record in self.report().items():
+            print('{:<40} {:>8} {:>12.4g} {:>12.4g} {:>8}'.format(name, record['calls'], record['total_time'], record['mean_time'], record['samples']))
+
+
+class _ProfilerCallback(Callback):
+    """
+    Keras callback that times the steps, validation and epochs of a training run.
+    It is only added to the callbacks of :meth:`DiffFlowCallback.train` when profiling is enabled, so that Keras does not run batch hooks otherwise.
+    """
+
+    def __init__(self, profiler, batch_size):
+        super().__init__()
+        self.profiler = profiler
+        self.batch_size = batch_size
+        self._t0 = {}
+
+    def _begin(self, name):
+        self._t0[name] = time.perf_counter()
+
+    def _end(self, name, batch_size=None):
+        self.profiler.add('train/'+name, time.perf_counter()-self._t0.pop(name), batch_size)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._begin('epoch')
+
+    def on_epoch_end(self, epoch, logs=None):
+        self._end('epoch')
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._begin('step')
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._end('step', self.batch_size)
+
+    def on_test_begin(self, logs=None):
+        self._begin('validation')
+
+    def on_test_end(self, logs=None):
+        self._end('validation')
+
+
+# methods of the flow whose first argument is a number of samples:
+_sample_count_methods = ['sample', 'MCSamples', 'sample_log_probability', 'sample_pool']
+
+
+def _profiled_method(flow, name, method, batch_argument=None):
+    """
+    Wrap a bound method of a flow so that its calls are recorded by the flow profiler.
+    The batch size is taken from the first argument, if `batch_argument` is 'count' (a number of samples) or 'coord' (a batch of coordinates), and is not recorded otherwise.
+    """
+    def _wrapper(*args, **kwargs):
+        profiler = flow.profiler
+        if profiler is None or tf.inside_function():
+            return method(*args, **kwargs)
+        batch_size = None
+        if len(args) > 0:
+            if batch_argument == 'count':
+                batch_size = int(args[0])
+            elif batch_argument == 'coord' and hasattr(args[0], 'shape'):
+                batch_size = int(np.prod(args[0].shape[:-1]))
+        with profiler.stage(name, batch_size):
+            return method(*args, **kwargs)
+    _wrapper.__name__ = name
+    _wrapper.__doc__ = method.__doc__
+    _wrapper._profiled = True
+    #
+    return _wrapper
+
 ###############################################################################
 # main class to compute NF-based tension:
 
@@ -263,6 +771,26 @@ class DiffFlowCallback(Callback):
     :type feedback: int, optional
     :param validation_split: fraction of samples to use for the validation sample, defaults to 0.1
     :type validation_split: float, optional
+    :param diagnostics_every: the diagnostics are computed every `diagnostics_every` training epochs, see :meth:`set_diagnostics`, defaults to 1.
+    :type diagnostics_every: int, optional
+    :param diagnostics_samples: number of samples used by the diagnostics, see :meth:`set_diagnostics`, defaults to None.
+    :type diagnostics_samples: int, optional
+    :param streaming: whether to stream the training samples instead of holding them in memory, see :meth:`_init_streaming`, defaults to False.
+    :type streaming: bool, optional
+    :param stream_source: in streaming mode, the source of chain rows, see :meth:`_init_streaming`. Defaults to None, in which case the rows of `chain` are used.
+    :type stream_source: optional
+    :param ignore_rows: in streaming mode, burn in removed from text file sources, a fraction of the rows of each file if smaller than one, a number of rows otherwise, defaults to 0.
+    :type ignore_rows: float, optional
+    :param chunk_size: in streaming mode, number of chain rows read at once, defaults to 100000.
+    :type chunk_size: int, optional
+    :param shuffle_buffer: in streaming mode, size of the shuffle buffer of the training dataset, defaults to 100000.
+    :type shuffle_buffer: int, optional
+    :param split_seed: random seed of the training/validation split, defaults to None, in which case it is drawn from the numpy random state. Flows built from the same chain with the same seed have the same validation samples.
+    :type split_seed: int, optional
+    :param precision: floating point precision of the flow, defaults to None, in which case the module precision (float32) is used. A copy of the flow in another precision, with the same weights, can be obtained with :meth:`with_precision`.
+    :type precision: :class:`tf.DType`, optional
+    :param profile: True or a :class:`~.FlowProfiler` to record the timing of the flow from its construction, see :meth:`enable_profiling`, defaults to None.
+    :type profile: bool or :class:`~.FlowProfiler`, optional
     :reference: George Papamakarios, Theo Pavlakou, Iain Murray (2017). Masked Autoregressive Flow for Density Estimation. `arXiv:1705.07057 <https://arxiv.org/abs/1705.07057>`_
     """
 
@@ -280,36 +808,62 @@ class DiffFlowCallback(Callback):
     self = DiffFlowCallback(chain, param_names=param_names, feedback=1)
     """
 
-    def __init__(self, chain, param_names=None, param_ranges=None, prior_bijector='ranges', apply_pregauss=True, trainable_bijector='MAF', learning_rate=1e-3, feedback=1, validation_split=0.1, **kwargs):
+    def __init__(self, chain, param_names=None, param_ranges=None, prior_bijector='ranges', apply_pregauss=True, trainable_bijector='MAF', learning_rate=1e-3, feedback=1, validation_split=0.1, diagnostics_every=1, diagnostics_samples=None, streaming=False, stream_source=None, ignore_rows=0, chunk_size=100000, shuffle_buffer=100000, split_seed=None, precision=None, profile=None, **kwargs):
 
         # read in varaiables:
         self.feedback = feedback
+        # profiling:
+        self.profiler = None
+        if profile is not None and profile is not False:
+            self.enable_profiling(profiler=profile if isinstance(profile, FlowProfiler) else None)
+        # precision:
+        self.prec = tf.as_dtype(prec if precision is None else precision)
+        self.np_prec = self.prec.as_numpy_dtype
+        # save settings to build replicas of the flow:
+        self._chain = chain
+        self._init_kwargs = {'param_names': param_names, 'param_ranges': param_ranges, 'prior_bijector': prior_bijector,
+                             'apply_pregauss': apply_pregauss, 'learning_rate': learning_rate, 'validation_split': validation_split,
+                             'diagnostics_every': diagnostics_every, 'diagnostics_samples': diagnostics_samples,
+                             'streaming': streaming, 'stream_source': stream_source, 'ignore_rows': ignore_rows, 'chunk_size': chunk_size, 'shuffle_buffer': shuffle_buffer,
+                             'split_seed': split_seed, 'precision': precision}
+        self._init_kwargs.update(kwargs)
 
         # Chain
-        self._init_chain(chain, param_names=param_names, param_ranges=param_ranges, validation_split=validation_split, prior_bijector=prior_bijector, apply_pregauss=apply_pregauss, trainable_bijector=trainable_bijector)
+        with self._profile('init/chain'):
+            self._init_chain(chain, param_names=param_names, param_ranges=param_ranges, validation_split=validation_split, prior_bijector=prior_bijector, apply_pregauss=apply_pregauss, trainable_bijector=trainable_bijector,
+                             streaming=streaming, stream_source=stream_source, ignore_rows=ignore_rows, chunk_size=chunk_size, shuffle_buffer=shuffle_buffer, split_seed=split_seed)
 
         # Transformed distribution
-        self._init_transf_dist(trainable_bijector, learning_rate=learning_rate, **kwargs)
+        with self._profile('init/transformed_distribution'):
+            self._init_transf_dist(trainable_bijector, learning_rate=learning_rate, **kwargs)
         if feedback > 0:
             print("Building flow")
             print("    - trainable parameters:", self.model.count_params())
 
         # Metrics
-        keys = ["loss", "val_loss", "chi2Z_ks", "chi2Z_ks_p", "evidence", "evidence_error"]
+        keys = ["loss", "val_loss", "chi2Z_ks", "chi2Z_ks_p", "evidence", "evidence_error", "diagnostics_epoch"]
         self.log = {_k: [] for _k in keys}
 
         self.chi2Y = np.sum(self.samples_test**2, axis=1)
         self.chi2Y_ks, self.chi2Y_ks_p = scipy.stats.kstest(self.chi2Y, 'chi2', args=(self.num_params,))
 
+        # Diagnostics
+        self.set_diagnostics(every=diagnostics_every, num_samples=diagnostics_samples)
+
         # internal variables:
         self.is_trained = False
+        self.sample_pool_dir = None
         self.MAP_coord = None
         self.MAP_logP = None
 
-    def _init_chain(self, chain, param_names=None, param_ranges=None, validation_split=0.1, prior_bijector='ranges', apply_pregauss=True, trainable_bijector='MAF'):
+    def _init_chain(self, chain, param_names=None, param_ranges=None, validation_split=0.1, prior_bijector='ranges', apply_pregauss=True, trainable_bijector='MAF', streaming=False, stream_source=None, ignore_rows=0, chunk_size=100000, shuffle_buffer=100000, split_seed=None):
         """
         Add documentation
         """
+        # seed of the training/test split:
+        if split_seed is None:
+            split_seed = np.random.randint(2**31-1)
+        self._split_seed = int(split_seed)
         # initialize param names:
         if param_names is None:
             param_names = chain.getParamNames().getRunningNames()
@@ -358,7 +912,7 @@ class DiffFlowCallback(Callback):
                 if do_extend or True:
                     center = 0.5 * (temp_range[0]+temp_range[1])
                     length = temp_range[1] - temp_range[0]
-                    eps = 10.*np.finfo(np_prec).eps
+                    eps = 10.*np.finfo(self.np_prec).eps
                     eps = 0.001
                     temp_range = [center - 0.5*length*(1.+eps), center + 0.5*length*(1.+eps)]
                 # save:
@@ -373,76 +927,209 @@ class DiffFlowCallback(Callback):
         except:
             self.chain_MAP = None
         # Prior bijector setup:
+        self._prior_bijector_spec = prior_bijector
         if prior_bijector == 'ranges':
-            self.prior_bijector = prior_bijector_helper([{'lower': tf.cast(self.parameter_ranges[name][0], prec), 'upper': tf.cast(self.parameter_ranges[name][1], prec)} for name in param_names])
+            self.prior_bijector = prior_bijector_helper([{'lower': tf.cast(self.parameter_ranges[name][0], self.prec), 'upper': tf.cast(self.parameter_ranges[name][1], self.prec)} for name in param_names], dtype=self.prec)
         elif isinstance(prior_bijector, tfp.bijectors.Bijector):
             self.prior_bijector = prior_bijector
         elif prior_bijector is None or prior_bijector is False:
             self.prior_bijector = tfb.Identity()
 
         self.bijectors = [self.prior_bijector]
+        self._pregauss_params = None
 
         # Samples indices:
         ind = [chain.index[name] for name in param_names]
         self.num_params = len(ind)
 
-        # cache chain samples and log likes:
-        self.chain_samples = chain.samples[:, ind]
-        self.chain_loglikes = chain.loglikes
-        self.chain_weights = chain.weights
+        # cache chain samples and log likes, in streaming mode the rows are read from the streaming source, see :meth:`_chain_rows`:
+        self._evidence_version = 0
+
+        # streaming mode:
+        if streaming:
+            self.chain_samples = None
+            self._init_streaming(chain, ind, validation_split=validation_split, apply_pregauss=apply_pregauss,
+                                 stream_source=stream_source, ignore_rows=ignore_rows, chunk_size=chunk_size, shuffle_buffer=shuffle_buffer)
+        else:
+            self.chain_samples = chain.samples[:, ind]
+            self.chain_loglikes = chain.loglikes
+            self.chain_weights = chain.weights
+
+            # Gaussian approximation (full chain)
+            if apply_pregauss:
+                temp_X = self.prior_bijector.inverse(chain.samples[:, ind]).numpy()
+                temp_chain = MCSamples(samples=temp_X, weights=chain.weights, names=param_names)
+                temp_gaussian_approx = gaussian_tension.gaussian_approximation(temp_chain, param_names=param_names)
+                self._pregauss_params = (temp_gaussian_approx.means[0], temp_gaussian_approx.covs[0])
+                temp_dist = tfd.MultivariateNormalTriL(loc=tf.cast(temp_gaussian_approx.means[0], self.prec), scale_tril=tf.linalg.cholesky(tf.cast(temp_gaussian_approx.covs[0], self.prec)))
+                self.bijectors.append(temp_dist.bijector)
+
+            self.fixed_bijector = tfb.Chain(self.bijectors)
+
+            # Split training/test:
+            n = chain.samples.shape[0]
+            indices = np.random.default_rng(self._split_seed).permutation(n)
+            n_split = int(validation_split*n)
+            test_idx, training_idx = indices[:n_split], indices[n_split:]
+
+            # Training:
+            self.samples = self.fixed_bijector.inverse(chain.samples[training_idx, :][:, ind]).numpy().astype(self.np_prec)
+            self.weights = chain.weights[training_idx]
+            self.weights *= len(self.weights) / np.sum(self.weights)  # weights normalized to number of samples
+            self.has_weights = np.any(self.weights != self.weights[0])
+            # self.Y = np.array(self.Y2X_bijector.inverse(self.samples.astype(self.np_prec)))
+            # assert not np.any(np.isnan(self.Y))
+            self.num_samples = len(self.samples)
+
+            # Test
+            self.samples_test = self.fixed_bijector.inverse(chain.samples[test_idx, :][:, ind]).numpy().astype(self.np_prec)
+            # self.Y_test = np.array(self.Y2X_bijector.inverse(self.samples_test.astype(self.np_prec)))
+            self.weights_test = chain.weights[test_idx]
+            self.weights_test *= len(self.weights_test) / np.sum(self.weights_test)  # weights normalized to number of samples
+
+            # Training sample generator
+            self.training_dataset = tf.data.Dataset.from_tensor_slices((tf.cast(self.samples, self.prec),     # input
+                                                                        tf.zeros(self.num_samples),      # output (dummy zero)
+                                                                        tf.cast(self.weights, self.prec),))   # weights
+            self.training_dataset = self.training_dataset.prefetch(tf.data.experimental.AUTOTUNE).cache()
+            self.training_dataset = self.training_dataset.shuffle(self.num_samples, reshuffle_each_iteration=True).repeat()
+
+        if self.feedback:
+            print("Building training/test samples")
+            if self.has_weights:
+                print("    - {}/{} training/test samples and non-uniform weights.".format(self.num_samples, self.samples_test.shape[0]))
+            else:
+                print("    - {}/{} training/test samples and uniform weights.".format(self.num_samples, self.samples_test.shape[0]))
 
-        # Gaussian approximation (full chain)
+    def _init_streaming(self, chain, ind, validation_split=0.1, apply_pregauss=True, stream_source=None, ignore_rows=0, chunk_size=100000, shuffle_buffer=100000):
+        """
+        Set up the training and test samples in streaming mode.
+        Chain rows are read in chunks, in random order, from `stream_source`, the Gaussian approximation is accumulated over chunks, the fixed bijector is applied lazily to each chunk and the training dataset uses a bounded shuffle buffer.
+        The training dataset, the evidence, the diagnostics and the MAP finder all read the same rows, from the streaming source (see :meth:`_chain_rows`). Apart from the test samples, only the weights and log likes of the rows are held in memory.
+
+        `stream_source` can be a tuple of samples, weights and, optionally, log likes, the path of a `.npy` file or one or more getdist chain text files. Files have the getdist column layout (weight, minus log likelihood, parameters in the order of `chain`), burn in is removed from text files with `ignore_rows`.
+        Samples in a tuple can be a 2D array or a list of 1D columns, in the order of `chain`.
+        Memory is only bounded if the rows are not all loaded: a memory-mapped `.npy` file or memory-mapped columns (for example those of a columnar chain copy) do that, text files too, at the price of parsing them at every pass. With the default source, the samples of `chain`, streaming avoids copies of the chain but `chain` itself is in memory.
+        With an external source `chain` only provides parameter names and ranges, and can be a thinned version of the full chain.
+        """
+        if stream_source is None:
+            stream_source = (chain.samples, chain.weights, chain.loglikes)
+        self._stream_source = stream_source
+        self._stream_ind = ind
+        self._stream_ignore_rows = ignore_rows
+        self._stream_chunk_size = chunk_size
+        self._stream_seed = self._split_seed
+        self._stream_validation_split = validation_split
+        # first pass over the chain, accumulate Gaussian approximation, test samples, weights and log likes of all rows, in chain order:
+        sum_w, sum_wx, sum_wxx = 0., 0., 0.
+        samples_test, weights_test = [], []
+        train_num, train_sum_w, train_weights = 0, 0., set()
+        chain_weights, chain_loglikes = [], []
+        best_loglike = np.inf
+        for samples, weights, loglikes, is_test in self._stream_chunks():
+            chain_weights.append(weights)
+            if loglikes is not None:
+                chain_loglikes.append(loglikes)
+                if np.amin(loglikes) < best_loglike:
+                    best_loglike = np.amin(loglikes)
+                    self.sample_MAP = samples[np.argmin(loglikes)]
+            if apply_pregauss:
+                temp_X = self.prior_bijector.inverse(self.cast(samples)).numpy().astype(np.float64)
+                sum_w += np.sum(weights)
+                sum_wx += np.dot(weights, temp_X)
+                sum_wxx += np.dot(temp_X.T, weights[:, None]*temp_X)
+            samples_test.append(samples[is_test])
+            weights_test.append(weights[is_test])
+            train_num += np.sum(~is_test)
+            train_sum_w += np.sum(weights[~is_test])
+            if len(train_weights) < 2:
+                train_weights.update(np.unique(weights[~is_test])[:2])
+        # Gaussian approximation:
         if apply_pregauss:
-            temp_X = self.prior_bijector.inverse(chain.samples[:, ind]).numpy()
-            temp_chain = MCSamples(samples=temp_X, weights=chain.weights, names=param_names)
-            temp_gaussian_approx = gaussian_tension.gaussian_approximation(temp_chain, param_names=param_names)
-            temp_dist = tfd.MultivariateNormalTriL(loc=tf.cast(temp_gaussian_approx.means[0], prec), scale_tril=tf.linalg.cholesky(tf.cast(temp_gaussian_approx.covs[0], prec)))
+            mean = sum_wx / sum_w
+            cov = sum_wxx / sum_w - np.outer(mean, mean)
+            self._pregauss_params = (mean, cov)
+            temp_dist = tfd.MultivariateNormalTriL(loc=tf.cast(mean, self.prec), scale_tril=tf.linalg.cholesky(tf.cast(cov, self.prec)))
             self.bijectors.append(temp_dist.bijector)
 
         self.fixed_bijector = tfb.Chain(self.bijectors)
 
-        # Split training/test:
-        n = chain.samples.shape[0]
-        indices = np.random.permutation(n)
-        n_split = int(validation_split*n)
-        test_idx, training_idx = indices[:n_split], indices[n_split:]
-
         # Training:
-        self.samples = self.fixed_bijector.inverse(chain.samples[training_idx, :][:, ind]).numpy().astype(np_prec)
-        self.weights = chain.weights[training_idx]
-        self.weights *= len(self.weights) / np.sum(self.weights)  # weights normalized to number of samples
-        self.has_weights = np.any(self.weights != self.weights[0])
-        # self.Y = np.array(self.Y2X_bijector.inverse(self.samples.astype(np_prec)))
-        # assert not np.any(np.isnan(self.Y))
-        self.num_samples = len(self.samples)
+        self.samples = None
+        self.weights = None
+        self.has_weights = len(train_weights) > 1
+        self.num_samples = int(train_num)
+        weight_norm = train_num / train_sum_w  # weights normalized to number of samples
 
         # Test
-        self.samples_test = self.fixed_bijector.inverse(chain.samples[test_idx, :][:, ind]).numpy().astype(np_prec)
-        # self.Y_test = np.array(self.Y2X_bijector.inverse(self.samples_test.astype(np_prec)))
-        self.weights_test = chain.weights[test_idx]
+        self.samples_test = self.fixed_bijector.inverse(self.cast(np.concatenate(samples_test))).numpy().astype(self.np_prec)
+        self.weights_test = np.concatenate(weights_test)
         self.weights_test *= len(self.weights_test) / np.sum(self.weights_test)  # weights normalized to number of samples
 
+        # weights and log likes of the streamed rows:
+        self.chain_weights = np.concatenate(chain_weights)
+        self.chain_loglikes = np.concatenate(chain_loglikes) if len(chain_loglikes) == len(chain_weights) else None
+
         # Training sample generator
-        self.training_dataset = tf.data.Dataset.from_tensor_slices((tf.cast(self.samples, prec),     # input
-                                                                    tf.zeros(self.num_samples),      # output (dummy zero)
-                                                                    tf.cast(self.weights, prec),))   # weights
-        self.training_dataset = self.training_dataset.prefetch(tf.data.experimental.AUTOTUNE).cache()
-        self.training_dataset = self.training_dataset.shuffle(self.num_samples, reshuffle_each_iteration=True).repeat()
+        def _generator():
+            for samples, weights, _, is_test in self._stream_chunks(shuffle=True):
+                yield samples[~is_test].astype(self.np_prec), (weight_norm*weights[~is_test]).astype(self.np_prec)
+        self.training_dataset = tf.data.Dataset.from_generator(_generator, output_signature=(tf.TensorSpec(shape=(None, self.num_params), dtype=self.prec),
+                                                                                              tf.TensorSpec(shape=(None,), dtype=self.prec)))
+        self.training_dataset = self.training_dataset.map(lambda x, w: (self.fixed_bijector.inverse(x), tf.zeros_like(w), w))
+        self.training_dataset = self.training_dataset.unbatch().shuffle(shuffle_buffer, reshuffle_each_iteration=True).repeat()
+        self.training_dataset = self.training_dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+    def _stream_chunks(self, shuffle=False):
+        """
+        Iterate over chunks of the streaming source, returning the samples of the flow parameters, the weights, the log likes and the test mask of each chunk.
+        The test mask only depends on the chunk so that the training/test split is the same at every pass.
+        Without shuffling chunks come in chain order.
+        """
+        for i, samples, weights, loglikes in _chain_chunks(self._stream_source, self._stream_ind, self._stream_chunk_size, shuffle=shuffle, ignore_rows=self._stream_ignore_rows):
+            is_test = np.random.default_rng([self._stream_seed, i]).random(len(weights)) < self._stream_validation_split
+            yield samples, weights, loglikes, is_test
+
+    def _chain_rows(self, idx):
+        """
+        Samples of the flow parameters in the chain rows `idx` (a slice or a sorted array of indexes).
+        In streaming mode the rows are collected with a pass over the streaming source, instead of from a full copy.
+        """
+        if self.chain_samples is not None:
+            return self.chain_samples[idx]
+        idx = np.arange(len(self.chain_weights))[idx]
+        rows, start = [], 0
+        for samples, _, _, _ in self._stream_chunks():
+            stop = start + len(samples)
+            rows.append(samples[idx[(idx >= start) & (idx < stop)] - start])
+            start = stop
+        #
+        return np.concatenate(rows)
 
-        if self.feedback:
-            print("Building training/test samples")
-            if self.has_weights:
-                print("    - {}/{} training/test samples and non-uniform weights.".format(self.num_samples, self.samples_test.shape[0]))
-            else:
-                print("    - {}/{} training/test samples and uniform weights.".format(self.num_samples, self.samples_test.shape[0]))
+    def _iterate_chain(self, batch_size=10000):
+        """
+        Iterate over chunks of `batch_size` rows of the chain, returning the index of the first row, the samples of the flow parameters, the log likes and the weights of each chunk.
+        In streaming mode chunks are read from the streaming source and do not cross the chunks of the source.
+        """
+        if self.chain_samples is not None:
+            for i in range(0, len(self.chain_weights), batch_size):
+                loglikes = None if self.chain_loglikes is None else self.chain_loglikes[i:i+batch_size]
+                yield i, self.chain_samples[i:i+batch_size], loglikes, self.chain_weights[i:i+batch_size]
+            return
+        start = 0
+        for samples, weights, loglikes, _ in self._stream_chunks():
+            for i in range(0, len(weights), batch_size):
+                yield start+i, samples[i:i+batch_size], None if loglikes is None else loglikes[i:i+batch_size], weights[i:i+batch_size]
+            start += len(weights)
 
     def _init_transf_dist(self, trainable_bijector, learning_rate=1e-4, **kwargs):
         """
         Add documentation
         """
         # Model
+        self._maf_kwargs = kwargs
         if trainable_bijector == 'MAF':
-            self.MAF = SimpleMAF(self.num_params, feedback=self.feedback, **kwargs)
+            self.MAF = SimpleMAF(self.num_params, feedback=self.feedback, dtype=self.prec, **kwargs)
             self.trainable_bijector = self.MAF.bijector
         elif isinstance(trainable_bijector, tfp.bijectors.Bijector):
             self.trainable_bijector = trainable_bijector
@@ -456,11 +1143,11 @@ class DiffFlowCallback(Callback):
         self.bijector = tfb.Chain(self.bijectors)
 
         # Full distribution
-        base_distribution = tfd.MultivariateNormalDiag(tf.zeros(self.num_params, dtype=prec), tf.ones(self.num_params, dtype=prec))
+        base_distribution = tfd.MultivariateNormalDiag(tf.zeros(self.num_params, dtype=self.prec), tf.ones(self.num_params, dtype=self.prec))
         self.distribution = tfd.TransformedDistribution(distribution=base_distribution, bijector=self.bijector)  # samples from std gaussian mapped to original space
 
         # Construct model (using only trainable bijector)
-        x_ = Input(shape=(self.num_params,), dtype=prec)
+        x_ = Input(shape=(self.num_params,), dtype=self.prec)
         log_prob_ = tfd.TransformedDistribution(distribution=base_distribution, bijector=self.trainable_bijector).log_prob(x_)
         self.model = Model(x_, log_prob_)
 
@@ -492,6 +1179,7 @@ class DiffFlowCallback(Callback):
         verbose=1
         kwargs = {}
         """
+        self._check_trainable()
         # We're trying to loop through the full sample each epoch
         if batch_size is None:
             if steps_per_epoch is None:
@@ -500,6 +1188,9 @@ class DiffFlowCallback(Callback):
         else:
             if steps_per_epoch is None:
                 steps_per_epoch = int(self.num_samples/batch_size)
+        # timing of the training steps:
+        if self.profiler is not None:
+            callbacks = callbacks + [_ProfilerCallback(self.profiler, batch_size)]
         # Run training:
         hist = self.model.fit(x=self.training_dataset.batch(batch_size),
                               batch_size=batch_size,
@@ -514,13 +1205,28 @@ class DiffFlowCallback(Callback):
         #
         return hist
 
-    def global_train(self, pop_size=10,  **kwargs):
+    def _check_trainable(self):
+        """
+        Raise if the flow is an inference only copy, see :meth:`with_precision`.
+        """
+        if getattr(self, '_inference_only', False):
+            raise ValueError('Cannot train a copy of a flow made with with_precision, train the original flow and make a new copy')
+
+    def global_train(self, pop_size=10, num_workers=None, successive_halving=False, **kwargs):
         """
         Training algorithm with some globalization strategy
 
+        If `num_workers` is given the population is trained concurrently, see :meth:`parallel_global_train`.
+        If `successive_halving` is True the population is pruned during training, see :meth:`successive_halving_train`.
+
         pop_size = 10
         kwargs = {'epochs': 10}
         """
+        self._check_trainable()
+        if successive_halving:
+            return self.successive_halving_train(pop_size=pop_size, **kwargs)
+        if num_workers is not None:
+            return self.parallel_global_train(pop_size=pop_size, num_workers=num_workers, **kwargs)
         # generate starting population of weights:
         population = [self.model.get_weights()]
         for i in range(pop_size-1):
@@ -548,30 +1254,356 @@ class DiffFlowCallback(Callback):
         #
         return population, loss, val_loss
 
+    def successive_halving_train(self, pop_size=10, epochs=100, rungs=None, reduction_factor=2, patience=None, min_delta=0., **kwargs):
+        """
+        Population training with a successive halving schedule.
+        All candidates are trained for the epochs of the first rung, then only the best `1/reduction_factor` of them, ranked on `val_loss`, continue to the next rung, until the last rung reaches `epochs`.
+        Candidates whose `val_loss` did not improve by more than `min_delta` for `patience` rungs are dropped as well.
+
+        :param pop_size: number of candidates, defaults to 10.
+        :type pop_size: int, optional
+        :param epochs: total number of epochs of the surviving candidate, defaults to 100.
+        :type epochs: int, optional
+        :param rungs: increasing list of epochs at which candidates are pruned, defaults to None. If None the rungs are spaced geometrically by `reduction_factor`, so that the last candidate is left for the final rung.
+        :type rungs: list, optional
+        :param reduction_factor: fraction of candidates that is dropped at each rung, defaults to 2.
+        :type reduction_factor: int, optional
+        :param patience: number of rungs without improvement after which a candidate is dropped, defaults to None (no patience).
+        :type patience: int, optional
+        :param min_delta: minimum decrease of `val_loss` that counts as an improvement, defaults to 0.
+        :type min_delta: float, optional
+        :param kwargs: other arguments passed to :meth:`train`.
+        :return: the population of weights, the last losses and validation losses of each candidate.
+        """
+        self._check_trainable()
+        # define the rungs:
+        if rungs is None:
+            num_rungs = int(np.ceil(np.log(pop_size) / np.log(reduction_factor))) + 1
+            rungs = [max(1, int(epochs / reduction_factor**(num_rungs-1-i))) for i in range(num_rungs)]
+        rungs = sorted(set(list(rungs) + [epochs]))
+        # generate starting population of weights:
+        population = [self.model.get_weights()]
+        for i in range(pop_size-1):
+            for layer in self.model.layers:
+                layer.build(layer.input_shape)
+            population.append(self.model.get_weights())
+        # evolve:
+        loss, val_loss = np.full(pop_size, np.inf), np.full(pop_size, np.inf)
+        stalled = np.zeros(pop_size, dtype=int)
+        survivors = np.arange(pop_size)
+        initial_epoch = 0
+        for rung in rungs:
+            for i in survivors:
+                # feedback:
+                if self.feedback:
+                    print('Training population', i+1, 'up to epoch', rung)
+                # train:
+                self.model.set_weights(population[i])
+                history = self.train(epochs=rung, initial_epoch=initial_epoch, **kwargs)
+                # update stored weights:
+                population[i] = self.model.get_weights()
+                # check improvement:
+                if val_loss[i] - history.history['val_loss'][-1] > min_delta:
+                    stalled[i] = 0
+                else:
+                    stalled[i] += 1
+                # save log:
+                loss[i] = history.history['loss'][-1]
+                val_loss[i] = history.history['val_loss'][-1]
+            initial_epoch = rung
+            # prune:
+            survivors = survivors[np.argsort(val_loss[survivors])]
+            survivors = survivors[:max(1, int(np.ceil(len(survivors) / reduction_factor)))]
+            if patience is not None:
+                survivors = np.concatenate([survivors[:1], [i for i in survivors[1:] if stalled[i] < patience]]).astype(int)
+        # select best:
+        self.model.set_weights(population[np.argmin(val_loss)])
+        #
+        return population, loss, val_loss
+
+    def parallel_global_train(self, pop_size=10, num_workers=None, **kwargs):
+        """
+        Train the population of :meth:`global_train` concurrently, with a process pool that holds one replica of the flow per worker.
+        Replicas are built from the same chain and settings, with the same MAF permutations and the same training/validation split as the flow, so that all candidates are compared on the same `val_loss` and the weights of the best one can be loaded in the flow.
+        The chain is sent once to each worker process.
+        Requires a :class:`~.SimpleMAF` trainable bijector and picklable flow settings and training arguments.
+        Workers are spawned, so the calling script has to be protected by `if __name__ == '__main__':`.
+
+        :param pop_size: number of candidates, defaults to 10.
+        :type pop_size: int, optional
+        :param num_workers: number of processes, defaults to None, in which case the number of CPU cores is used.
+        :type num_workers: int, optional
+        :param kwargs: arguments passed to :meth:`train`.
+        :return: the population of weights, the final losses and validation losses.
+        """
+        self._check_trainable()
+        if not hasattr(self, 'MAF'):
+            raise ValueError('Parallel training requires a SimpleMAF trainable bijector')
+        if num_workers is None:
+            num_workers = os.cpu_count()
+        num_workers = min(num_workers, pop_size)
+        # replica settings:
+        init_kwargs = copy.copy(self._init_kwargs)
+        init_kwargs['permutations'] = self.MAF.permutations
+        init_kwargs['split_seed'] = self._split_seed
+        seeds = np.random.randint(0, 2**31-1, size=pop_size)
+        # train:
+        if self.feedback:
+            print('Training population of', pop_size, 'on', num_workers, 'processes')
+        context = multiprocessing.get_context('spawn')
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, mp_context=context,
+                                                    initializer=_population_worker_init, initargs=(max(1, (os.cpu_count() or 1)//num_workers), self._chain)) as executor:
+            results = list(executor.map(_population_worker, [init_kwargs]*pop_size, [kwargs]*pop_size, seeds))
+        population = [res[0] for res in results]
+        loss = np.array([res[1] for res in results])
+        val_loss = np.array([res[2] for res in results])
+        # select best:
+        best = np.argmin(val_loss)
+        self.model.set_weights(population[best])
+        self.log = results[best][3]
+        self.is_trained = True
+        #
+        return population, loss, val_loss
+
+    def set_diagnostics(self, every=1, num_samples=None):
+        """
+        Configure the diagnostics (KS test of the gaussianized test samples and flow evidence) that are computed at the end of training epochs.
+
+        :param every: the diagnostics are computed every `every` epochs, 0 or None disables them, defaults to 1.
+        :type every: int, optional
+        :param num_samples: if given, the diagnostics are computed on a fixed random subsample of this size of the test samples and of the chain, defaults to None (all samples).
+        :type num_samples: int, optional
+        """
+        self.diagnostics_every = every
+        # test samples:
+        if num_samples is None or num_samples >= len(self.samples_test):
+            self._diagnostics_samples_test = self.samples_test
+            self._diagnostics_weights_test = self.weights_test
+        else:
+            idx = np.random.choice(len(self.samples_test), size=num_samples, replace=False)
+            self._diagnostics_samples_test = self.samples_test[idx]
+            self._diagnostics_weights_test = self.weights_test[idx]
+        # chain samples, None means the full chain read in chunks:
+        num_chain = len(self.chain_weights)
+        if num_samples is None or num_samples >= num_chain:
+            self._diagnostics_chain = None
+        else:
+            idx = np.sort(np.random.choice(num_chain, size=num_samples, replace=False))
+            self._diagnostics_chain = (self._chain_rows(idx), None if self.chain_loglikes is None else self.chain_loglikes[idx], self.chain_weights[idx])
+        # cached evidence terms of the previous diagnostics samples are stale:
+        self._evidence_version += 1
+
+    @_flow_function('coord')
+    def _diagnostics_chi2Z(self, samples):
+        """
+        Squared norm of the gaussianized samples.
+        """
+        return tf.reduce_sum(self.trainable_bijector.inverse(samples)**2, axis=-1)
+
+    @_flow_function('coord')
+    def _evidence_fixed_part(self, samples):
+        """
+        Pre-whitened samples and log determinant of the Jacobian of the fixed (prior and Gaussian approximation) bijector.
+        This part of the flow log probability does not change during training.
+        """
+        return self.fixed_bijector.inverse(samples), self.fixed_bijector.inverse_log_det_jacobian(samples, event_ndims=1)
+
+    @_flow_function('coord')
+    def _evidence_trainable_part(self, whitened_samples):
+        """
+        Log probability of pre-whitened samples under the trainable part of the flow.
+        """
+        return self.model(whitened_samples)
+
+    def enable_profiling(self, trace_stages=None, logdir=None, profiler=None):
+        """
+        Start recording wall time, number of calls and batch sizes of the public methods of the flow and of the training stages (Keras steps, validation, epochs and diagnostics).
+        Profiling is opt-in and has no cost when disabled.
+
+        :param trace_stages: list of stages to annotate for the tensorflow profiler, see :class:`~.FlowProfiler`, defaults to None.
+        :type trace_stages: list, optional
+        :param logdir: if given a tensorflow profiler session writing to this directory is started, defaults to None.
+        :type logdir: str, optional
+        :param profiler: an existing :class:`~.FlowProfiler`, for example to collect the timing of several flows together, defaults to None.
+        :type profiler: :class:`~.FlowProfiler`, optional
+        :return: the :class:`~.FlowProfiler`.
+        """
+        if profiler is None:
+            profiler = FlowProfiler(trace_stages=trace_stages, logdir=logdir)
+        self.profiler = profiler
+        # wrap the public methods:
+        self._unwrap_profiled_methods()
+        for name in dir(type(self)):
+            if name.startswith('_') or name in dir(Callback) or name in ['cast', 'enable_profiling', 'disable_profiling', 'profiling_report', 'tracing_report']:
+                continue
+            method = getattr(type(self), name)
+            if isinstance(method, property) or not callable(method):
+                continue
+            # only sample counts and batches of coordinates are recorded as batch sizes:
+            if name in _sample_count_methods:
+                batch_argument = 'count'
+            elif isinstance(method, _flow_function) and method.specs[:1] == ('coord',):
+                batch_argument = 'coord'
+            else:
+                batch_argument = None
+            self.__dict__[name] = _profiled_method(self, name, getattr(self, name), batch_argument)
+        profiler.start_trace()
+        #
+        return profiler
+
+    def disable_profiling(self):
+        """
+        Stop profiling and stop the tensorflow profiler session, if running.
+
+        :return: the report of the profiler, see :meth:`FlowProfiler.report`.
+        """
+        if self.profiler is None:
+            return {}
+        profiler, self.profiler = self.profiler, None
+        profiler.stop_trace()
+        self._unwrap_profiled_methods()
+        #
+        return profiler.report()
+
+    def profiling_report(self, path=None):
+        """
+        Report of the profiler, see :meth:`FlowProfiler.report`.
+
+        :param path: if given the report is also saved in json format to this file, defaults to None.
+        :type path: str, optional
+        :return: the report.
+        """
+        if self.profiler is None:
+            raise ValueError('Profiling is not enabled, call enable_profiling first')
+        if path is not None:
+            self.profiler.save(path)
+        #
+        return self.profiler.report()
+
+    def tracing_report(self, max_traces=None):
+        """
+        Number of times each compiled method has been traced.
+        Methods with an input signature (see :class:`~._flow_function`) are compiled for each flow and should be traced once. The other methods are :func:`tf.function` shared by all flows, and their count is `shared`.
+
+        :param max_traces: if given, a warning is issued for each per-flow method traced more than `max_traces` times, defaults to None.
+        :type max_traces: int, optional
+        :return: dictionary with the number of traces and whether the function is shared, for each method.
+        """
+        report = {}
+        for name in dir(type(self)):
+            method = getattr(type(self), name)
+            if isinstance(method, _flow_function):
+                # sum over the values of the python options:
+                compiled = [function for key, function in self.__dict__.get('_compiled_functions', {}).items() if key == name or (isinstance(key, tuple) and key[0] == name)]
+                report[name] = {'traces': sum([function.experimental_get_tracing_count() for function in compiled]), 'shared': False}
+                if max_traces is not None and report[name]['traces'] > max_traces:
+                    warnings.warn('{} has been traced {} times'.format(name, report[name]['traces']))
+            elif hasattr(method, 'experimental_get_tracing_count'):
+                report[name] = {'traces': method.experimental_get_tracing_count(), 'shared': True}
+        #
+        return report
+
+    def _unwrap_profiled_methods(self):
+        for name in [name for name, value in self.__dict__.items() if getattr(value, '_profiled', False)]:
+            del self.__dict__[name]
+
+    def _profile(self, name, batch_size=None):
+        """
+        Timing context of a stage, a no-op when profiling is disabled.
+        """
+        if getattr(self, 'profiler', None) is None:
+            return contextlib.nullcontext()
+        return self.profiler.stage(name, batch_size)
+
+    def export(self, path):
+        """
+        Export the flow as a self-contained artifact, see :func:`export_flow`.
+        """
+        export_flow(self, path)
+
     ###############################################################################
     # Utility functions:
 
+    def with_precision(self, precision):
+        """
+        Return a copy of the flow that evaluates in a different floating point precision, with the same trained weights.
+        This allows, for example, training in float32 and running geometry, ODE solvers and optimizers in float64.
+        The copy is meant for inference: it shares chain and training data with the flow and cannot be trained, its weights are a snapshot of the weights of the flow. The prior bijector has to be built from the parameter ranges (or be the identity) and the trainable bijector has to be a :class:`~.SimpleMAF` (or the identity).
+
+        :param precision: floating point precision of the copy, for example :class:`tf.float64`.
+        :type precision: :class:`tf.DType`
+        :return: a :class:`~.DiffFlowCallback`.
+        """
+        precision = tf.as_dtype(precision)
+        new = copy.copy(self)
+        new._inference_only = True
+        new.log = copy.deepcopy(self.log)
+        # compiled functions have the signature of the original precision:
+        new._compiled_functions = {}
+        # profiling wrappers are bound to the original flow:
+        new._unwrap_profiled_methods()
+        if self.profiler is not None:
+            new.enable_profiling(profiler=self.profiler)
+        new.prec = precision
+        new.np_prec = precision.as_numpy_dtype
+        new._grid_cache, new._evidence_cache = {}, {}
+        # prior bijector:
+        if isinstance(self._prior_bijector_spec, str) and self._prior_bijector_spec == 'ranges':
+            new.prior_bijector = prior_bijector_helper([{'lower': tf.cast(self.parameter_ranges[name][0], precision), 'upper': tf.cast(self.parameter_ranges[name][1], precision)} for name in self.param_names], dtype=precision)
+        elif self._prior_bijector_spec is None or self._prior_bijector_spec is False:
+            new.prior_bijector = tfb.Identity()
+        else:
+            raise ValueError('Cannot change the precision of a custom prior bijector')
+        new.bijectors = [new.prior_bijector]
+        # Gaussian approximation:
+        if self._pregauss_params is not None:
+            mean, cov = self._pregauss_params
+            new.bijectors.append(tfd.MultivariateNormalTriL(loc=tf.cast(mean, precision), scale_tril=tf.linalg.cholesky(tf.cast(cov, precision))).bijector)
+        new.fixed_bijector = tfb.Chain(new.bijectors)
+        # trainable bijector, with the weights of the flow:
+        if hasattr(self, 'MAF'):
+            maf_kwargs = {k: v for k, v in self._maf_kwargs.items() if k not in ['permutations', 'dtype']}
+            new.MAF = SimpleMAF(self.num_params, permutations=self.MAF.permutations, dtype=precision, **maf_kwargs)
+            new.MAF.bijector.forward(tf.zeros((1, self.num_params), dtype=precision))
+            for new_var, var in zip(new.MAF.bijector.trainable_variables, self.MAF.bijector.trainable_variables):
+                new_var.assign(tf.cast(var, precision))
+            new.trainable_bijector = new.MAF.bijector
+        elif isinstance(self.trainable_bijector, tfb.Identity):
+            new.trainable_bijector = tfb.Identity()
+        else:
+            raise ValueError('Cannot change the precision of a custom trainable bijector')
+        new.bijectors.append(new.trainable_bijector)
+        new.bijector = tfb.Chain(new.bijectors)
+        # distribution:
+        base_distribution = tfd.MultivariateNormalDiag(tf.zeros(self.num_params, dtype=precision), tf.ones(self.num_params, dtype=precision))
+        new.distribution = tfd.TransformedDistribution(distribution=base_distribution, bijector=new.bijector)
+        # model of the trainable bijector, not compiled since the copy is not trained:
+        x_ = Input(shape=(self.num_params,), dtype=precision)
+        new.model = Model(x_, tfd.TransformedDistribution(distribution=base_distribution, bijector=new.trainable_bijector).log_prob(x_))
+        #
+        return new
+
     def cast(self, v):
         """
         Cast vector to internal precision of the flow. Converts to tensorflow tensor.
         """
-        return tf.cast(v, dtype=prec)
+        return tf.cast(v, dtype=self.prec)
 
-    @tf.function()
+    @_flow_function('int')
     def sample(self, N):
         """
         Return samples from the synthetic probablity.
         """
         return self.distribution.sample(N)
 
-    @tf.function()
+    @_flow_function('coord')
     def log_probability(self, coord):
         """
         Returns learned log probability.
         """
         return self.distribution.log_prob(coord)
 
-    @tf.function()
+    @_flow_function('coord')
     def log_probability_jacobian(self, coord):
         """
         Computes the Jacobian of the log probability.
@@ -581,7 +1613,7 @@ class DiffFlowCallback(Callback):
             f = self.log_probability(coord)
         return tape.gradient(f, coord)
 
-    @tf.function()
+    @_flow_function('coord')
     def log_probability_abs(self, abs_coord):
         """
         Returns learned log probability in original parameter space as a function of abstract coordinates.
@@ -590,7 +1622,7 @@ class DiffFlowCallback(Callback):
         temp_2 = self.distribution.bijector.forward_log_det_jacobian(abs_coord, event_ndims=1)
         return temp_1 - temp_2
 
-    @tf.function()
+    @_flow_function('coord')
     def log_probability_abs_jacobian(self, abs_coord):
         """
         Computes the Jacobian of the log probability.
@@ -600,16 +1632,23 @@ class DiffFlowCallback(Callback):
             f = self.log_probability_abs(abs_coord)
         return tape.gradient(f, abs_coord)
 
-    def MCSamples(self, size, logLikes=True, **kwargs):
+    def MCSamples(self, size, logLikes=True, batch_size=100000, use_pool=False, **kwargs):
         """
         Return MCSamples object from the syntetic probability.
-        """
-        samples = self.sample(size)
-        if logLikes:
-            loglikes = -self.log_probability(samples)
+        Samples and log likelihoods are computed together in chunks of `batch_size`, see :meth:`sample_log_probability`.
+        If `use_pool` is True the samples are taken from the sample pool of the flow, see :meth:`sample_pool`, and repeated calls return the same samples.
+        """
+        if use_pool:
+            samples, log_prob, _ = self.sample_pool(size, batch_size=batch_size)
+            samples = np.array(samples)
+            loglikes = -np.array(log_prob) if logLikes else None
+        elif logLikes:
+            samples, log_prob = self.sample_log_probability(size, batch_size=batch_size)
+            loglikes = -log_prob
         else:
+            samples = np.concatenate([self.sample(min(batch_size, size-i)).numpy() for i in range(0, size, batch_size)], axis=0)
             loglikes = None
-        mc_samples = MCSamples(samples=samples.numpy(), loglikes=loglikes.numpy(),
+        mc_samples = MCSamples(samples=samples, loglikes=loglikes,
                                names=self.param_names, labels=self.param_labels,
                                ranges=self.parameter_ranges,
                                name_tag=self.name_tag, **kwargs)
@@ -654,6 +1693,60 @@ class DiffFlowCallback(Callback):
         #
         return result
 
+    @_flow_function('coord')
+    def _batch_MAP_lbfgs(self, x0_abs, max_iterations=1000, tolerance=1e-5):
+        """
+        Compiled batched L-BFGS maximization of the log probability, in abstract coordinates.
+        """
+        def _value_and_gradients(x):
+            return tfp.math.value_and_gradient(lambda y: -self.log_probability_abs(y), x)
+        results = tfp.optimizer.lbfgs_minimize(_value_and_gradients, initial_position=x0_abs, max_iterations=max_iterations, tolerance=tolerance)
+        #
+        return results.position, -results.objective_value, results.converged
+
+    def batch_MAP_finder(self, num_starts=100, max_iterations=1000, tolerance=1e-5):
+        """
+        Function that finds the maximum of the synthetic posterior with a batch of L-BFGS optimizations, in abstract coordinates, that run at once inside a :func:`tf.function`.
+        Half of the starting points are drawn from the flow and half from the chain, the chain MAP (or sample MAP) is always included.
+
+        :param num_starts: number of starting points, defaults to 100.
+        :type num_starts: int, optional
+        :param max_iterations: maximum number of L-BFGS iterations, defaults to 1000.
+        :type max_iterations: int, optional
+        :param tolerance: tolerance on the gradient, defaults to 1e-5.
+        :type tolerance: float, optional
+        :return: a dictionary with the best point (`MAP_coord`, `MAP_logP`), all the local optima (`optima`, `optima_logP`, `converged`) and their spread around the MAP (`spread`).
+        """
+        # starting points:
+        if self.chain_MAP is not None:
+            starts = [np.array([self.chain_MAP])]
+        else:
+            starts = [np.array([self.sample_MAP])]
+        num_flow = (num_starts-1) // 2
+        num_chain = num_starts - 1 - num_flow
+        if num_flow > 0:
+            starts.append(self.sample(num_flow).numpy())
+        if num_chain > 0:
+            idx = np.random.choice(len(self.chain_weights), size=num_chain, replace=True, p=self.chain_weights/np.sum(self.chain_weights))
+            starts.append(self._chain_rows(np.sort(idx)))
+        x0_abs = self.map_to_abstract_coord(self.cast(np.concatenate(starts, axis=0)))
+        # optimize:
+        position, logP, converged = self._batch_MAP_lbfgs(x0_abs, max_iterations=max_iterations, tolerance=tolerance)
+        optima = self.map_to_original_coord(position).numpy()
+        logP = logP.numpy()
+        logP[~np.all(np.isfinite(optima), axis=1)] = -np.inf
+        # select best:
+        best = np.argmax(logP)
+        self.MAP_coord = optima[best]
+        self.MAP_logP = logP[best]
+        # spread of the local optima:
+        _s = np.isfinite(logP)
+        spread = np.sqrt(np.average((optima[_s]-optima[best])**2, axis=0))
+        #
+        return {'MAP_coord': self.MAP_coord, 'MAP_logP': self.MAP_logP,
+                'optima': optima, 'optima_logP': logP, 'converged': converged.numpy(),
+                'spread': spread}
+
     def sigma_to_length(self, nsigma):
         """
         Approximate proper length of events separated by given number of sigmas.
@@ -661,37 +1754,297 @@ class DiffFlowCallback(Callback):
         """
         return np.sqrt(scipy.stats.chi2.isf(1. - utils.from_sigma_to_confidence(nsigma), self.num_params))
 
-    def evidence(self):
+    @_flow_function('int')
+    def _sample_log_probability(self, N):
+        """
+        Draw samples and compute their log probability in a single forward pass.
+        The log probability follows from the density of the gaussian samples and the log determinant of the Jacobian of the forward map, so the bijector chain is never inverted.
+        Returns samples, log probability and the samples in abstract coordinates.
+        """
+        abs_samples = self.distribution.distribution.sample(N)
+        samples = self.distribution.bijector.forward(abs_samples)
+        log_prob = self.distribution.distribution.log_prob(abs_samples) - self.distribution.bijector.forward_log_det_jacobian(abs_samples, event_ndims=1)
+        #
+        return samples, log_prob, abs_samples
+
+    def sample_log_probability(self, N, batch_size=100000):
+        """
+        Draw samples from the flow together with their log probability, see :meth:`_sample_log_probability`.
+        Samples are drawn in chunks of `batch_size` and written to pre-allocated arrays, so that large numbers of samples do not require a single large tensor.
+
+        :param N: number of samples.
+        :type N: int
+        :param batch_size: number of samples per chunk, defaults to 100000.
+        :type batch_size: int, optional
+        :return: samples with shape (N, D) and log probabilities with shape (N,), as numpy arrays.
+        """
+        N = int(N)
+        samples = np.empty((N, self.num_params), dtype=self.np_prec)
+        log_prob = np.empty(N, dtype=self.np_prec)
+        for i in range(0, N, batch_size):
+            temp_samples, temp_log_prob, _ = self._sample_log_probability(min(batch_size, N-i))
+            samples[i:i+batch_size] = temp_samples.numpy()
+            log_prob[i:i+batch_size] = temp_log_prob.numpy()
+        #
+        return samples, log_prob
+
+    def sample_pool(self, size, batch_size=100000):
+        """
+        Samples of the flow served from a sample pool.
+        The pool holds samples, their log probability and their abstract coordinates. It is generated once, grown when a larger size is requested, and always returns the first `size` samples, so repeated requests are deterministic and free.
+        The pool is tied to the current weights of the flow. If `sample_pool_dir` is set (:func:`load_flow` sets it to the flow cache directory) the pool is saved there as a single `.npy` file and memory-mapped, so that it is shared between runs and scripts.
+
+        :param size: number of samples.
+        :type size: int
+        :param batch_size: number of samples per chunk when the pool is generated, defaults to 100000.
+        :type batch_size: int, optional
+        :return: samples with shape (size, D), log probabilities with shape (size,) and abstract coordinates with shape (size, D). These are read-only views of the pool.
+        """
+        size = int(size)
+        key = self._sample_pool_key()
+        pool = getattr(self, '_sample_pool', None)
+        if pool is None or pool[0] != key:
+            pool = (key, self._load_sample_pool(key))
+        if pool[1] is None or len(pool[1]) < size:
+            pool = (key, self._extend_sample_pool(pool[1], key, size, batch_size))
+        self._sample_pool = pool
+        # columns are samples, log probability, abstract coordinates:
+        temp = pool[1][:size]
+        #
+        return temp[:, :self.num_params], temp[:, self.num_params], temp[:, self.num_params+1:]
+
+    def _sample_pool_key(self):
+        """
+        Key of the sample pool: the weights of the flow, and the parameter names and ranges, since transformed flows share the weights and flows without trainable bijector have none.
+        """
+        sha = hashlib.sha256(self._weights_key().encode())
+        sha.update(_cache_key_repr([self.param_names, self.parameter_ranges]).encode())
+        #
+        return sha.hexdigest()[:16]
+
+    def _sample_pool_file(self, key):
+        if getattr(self, 'sample_pool_dir', None) is None:
+            return None
+        return os.path.join(self.sample_pool_dir, 'sample_pool_'+key+'.npy')
+
+    def _load_sample_pool(self, key):
+        """
+        Memory-map the saved sample pool of the flow, if any.
+        """
+        file = self._sample_pool_file(key)
+        if file is None or not os.path.isfile(file):
+            return None
+        return np.load(file, mmap_mode='r')
+
+    def _extend_sample_pool(self, pool, key, size, batch_size=100000):
+        """
+        Grow the sample pool to at least `size` samples, keeping the existing samples in front.
+        The pool at least doubles, so that growing it in small steps stays cheap.
+        Saved pools are written to a temporary file that replaces the old one, so readers never see a partial pool.
+        """
+        old_size = 0 if pool is None else len(pool)
+        new_size = max(size, 2*old_size)
+        file = self._sample_pool_file(key)
+        shape = (new_size, 2*self.num_params+1)
+        if file is None:
+            new_pool = np.empty(shape, dtype=self.np_prec)
+        else:
+            if not os.path.exists(self.sample_pool_dir):
+                os.makedirs(self.sample_pool_dir)
+            temp_file = file[:-4]+'_{}.tmp.npy'.format(os.getpid())
+            new_pool = np.lib.format.open_memmap(temp_file, mode='w+', dtype=self.np_prec, shape=shape)
+        # copy the existing pool:
+        for i in range(0, old_size, batch_size):
+            new_pool[i:i+batch_size] = pool[i:i+batch_size]
+        # generate the new samples:
+        for i in range(old_size, new_size, batch_size):
+            samples, log_prob, abs_samples = self._sample_log_probability(min(batch_size, new_size-i))
+            new_pool[i:i+batch_size, :self.num_params] = samples.numpy()
+            new_pool[i:i+batch_size, self.num_params] = log_prob.numpy()
+            new_pool[i:i+batch_size, self.num_params+1:] = abs_samples.numpy()
+        # save:
+        if file is not None:
+            new_pool.flush()
+            del new_pool
+            os.replace(temp_file, file)
+            new_pool = np.load(file, mmap_mode='r')
+        #
+        return new_pool
+
+    def credible_levels(self, conf=[0.68, 0.95], num_samples=100000, batch_size=10000, num_bootstrap=100):
+        """
+        Estimate the log probability thresholds of the highest posterior density regions of the flow, in any dimension.
+        Samples are drawn from the flow and their log probability is evaluated in compiled chunks. The region with confidence `c` contains the points with log probability above the `1-c` quantile of the sampled log probabilities.
+        The cost scales linearly with the number of samples.
+
+        :param conf: confidence levels, defaults to [0.68, 0.95].
+        :type conf: list, optional
+        :param num_samples: number of samples, defaults to 100000.
+        :type num_samples: int, optional
+        :param batch_size: number of samples per chunk, defaults to 10000.
+        :type batch_size: int, optional
+        :param num_bootstrap: number of bootstrap resamplings for the error estimate, defaults to 100.
+        :type num_bootstrap: int, optional
+        :return: log probability thresholds and their bootstrap errors, one per confidence level.
+        """
+        quantiles = 1. - np.atleast_1d(conf)
+        # sample and compute log probability:
+        log_prob = []
+        for i in range(0, num_samples, batch_size):
+            _, temp, _ = self._sample_log_probability(min(batch_size, num_samples-i))
+            log_prob.append(temp.numpy())
+        log_prob = np.concatenate(log_prob)
+        log_prob = log_prob[np.isfinite(log_prob)]
+        # thresholds:
+        levels = np.quantile(log_prob, quantiles)
+        # bootstrap errors:
+        if num_bootstrap > 0:
+            boot = np.array([np.quantile(np.random.choice(log_prob, size=len(log_prob), replace=True), quantiles) for _ in range(num_bootstrap)])
+            errors = np.std(boot, axis=0)
+        else:
+            errors = np.zeros_like(levels)
+        #
+        return levels, errors
+
+    def _weights_key(self):
+        """
+        Fingerprint of the current weights of the flow, used to invalidate caches.
+        """
+        sha = hashlib.sha256()
+        for var in self.bijector.trainable_variables:
+            sha.update(var.numpy().tobytes())
+        return sha.hexdigest()
+
+    def _evidence_chunks(self, batch_size=10000, diagnostics=False):
+        """
+        Iterate over the chunks of samples the evidence is computed on, returning the index of the first row, the samples and the log likes of each chunk, and the weights of all samples.
+        These are the rows of the chain or, if `diagnostics` is True, the samples of the training diagnostics (see :meth:`set_diagnostics`).
+        """
+        if diagnostics and self._diagnostics_chain is not None:
+            samples, loglikes, weights = self._diagnostics_chain
+            chunks = ((i, samples[i:i+batch_size], loglikes[i:i+batch_size]) for i in range(0, len(weights), batch_size))
+        else:
+            weights = self.chain_weights
+            chunks = ((i, samples, loglikes) for i, samples, loglikes, _ in self._iterate_chain(batch_size))
+        #
+        return chunks, weights
+
+    def _evidence_terms(self, batch_size=10000, diagnostics=False):
+        """
+        Per sample terms of the flow evidence, and their weights, computed in chunks of `batch_size` samples, see :meth:`_evidence_chunks`.
+        Each chunk caches the part of the terms that does not depend on the flow weights (log likes and fixed bijector, with the pre-whitened samples), so that during training only the trainable bijector is evaluated, and the terms, that are reused until the weights change.
+        Chunks are keyed on their index and on a counter of the version of the samples, the pre-whitened samples are not cached in streaming mode.
+        """
+        if not hasattr(self, '_evidence_cache'):
+            self._evidence_cache = {}
+        weights_key = self._weights_key()
+        subsample = diagnostics and self._diagnostics_chain is not None
+        keep_inputs = subsample or self.chain_samples is not None
+        chunks, weights = self._evidence_chunks(batch_size, diagnostics=diagnostics)
+        terms = []
+        for i, samples, loglikes in chunks:
+            key = (subsample, i, batch_size)
+            cached = self._evidence_cache.get(key)
+            if cached is None or cached['version'] != self._evidence_version:
+                cached = {'version': self._evidence_version, 'inputs': None, 'weights_key': None, 'terms': None}
+                self._evidence_cache[key] = cached
+            if cached['weights_key'] != weights_key:
+                inputs = cached['inputs']
+                if inputs is None:
+                    whitened_samples, log_det = self._evidence_fixed_part(samples)
+                    inputs = (whitened_samples, -self.cast(loglikes) - log_det)
+                    if keep_inputs:
+                        cached['inputs'] = inputs
+                cached['terms'] = (inputs[1] - self._evidence_trainable_part(inputs[0])).numpy()
+                cached['weights_key'] = weights_key
+            terms.append(cached['terms'])
+        #
+        return np.concatenate(terms), weights
+
+    def evidence(self, batch_size=10000):
         """
         Get evidence from the flow
         """
-        # compute log likes:
-        flow_log_likes = self.log_probability(self.cast(self.chain_samples))
         # compute residuals:
-        diffs = -self.chain_loglikes -flow_log_likes
+        diffs, weights = self._evidence_terms(batch_size=batch_size)
         # compute average and error:
-        average = np.average(diffs, weights=self.chain_weights)
-        variance = np.average((diffs-average)**2, weights=self.chain_weights)
+        average = np.average(diffs, weights=weights)
+        variance = np.average((diffs-average)**2, weights=weights)
         return (average, np.sqrt(variance))
 
+    def evidence_estimate(self, method='chain', log_posterior=None, num_samples=100000, batch_size=10000, num_bootstrap=100):
+        """
+        Estimate the log evidence with error control.
+
+        With `method='chain'` the log evidence is the weighted average, over the chain, of the difference between the unnormalized log posterior of the chain and the flow log probability, see :meth:`evidence`. Per sample terms are cached between calls.
+        With `method='importance'` the flow is used as proposal: samples are drawn from the flow and weighted with `log_posterior`, the unnormalized log posterior, that has to be given.
+
+        :param method: either 'chain' or 'importance', defaults to 'chain'.
+        :type method: str, optional
+        :param log_posterior: function returning the unnormalized log posterior on an array of points in (original) parameter space, defaults to None.
+        :param num_samples: number of importance samples, defaults to 100000.
+        :type num_samples: int, optional
+        :param batch_size: number of samples per chunk, defaults to 10000.
+        :type batch_size: int, optional
+        :param num_bootstrap: number of bootstrap resamplings for the error, defaults to 100.
+        :type num_bootstrap: int, optional
+        :return: a dictionary with the log evidence (`log_evidence`), its bootstrap error (`error`), the scatter of the per sample terms (`std`) and the effective sample size (`ess`).
+        """
+        if method == 'chain':
+            diffs, weights = self._evidence_terms(batch_size=batch_size)
+            _s = np.isfinite(diffs)
+            diffs, weights = diffs[_s], weights[_s]
+
+            def _estimate(idx):
+                return np.average(diffs[idx], weights=weights[idx])
+            log_evidence = _estimate(slice(None))
+            std = np.sqrt(np.average((diffs-log_evidence)**2, weights=weights))
+            ess = np.sum(weights)**2 / np.sum(weights**2)
+        elif method == 'importance':
+            if log_posterior is None:
+                raise ValueError('Importance sampling requires the log posterior')
+            log_w = []
+            for i in range(0, num_samples, batch_size):
+                samples, log_q, _ = self._sample_log_probability(min(batch_size, num_samples-i))
+                log_w.append(np.asarray(log_posterior(samples.numpy())) - log_q.numpy())
+            log_w = np.concatenate(log_w)
+            log_w = log_w[np.isfinite(log_w)]
+
+            def _estimate(idx):
+                return scipy.special.logsumexp(log_w[idx]) - np.log(len(log_w[idx]))
+            log_evidence = _estimate(slice(None))
+            w = np.exp(log_w - np.amax(log_w))
+            std = np.std(log_w)
+            ess = np.sum(w)**2 / np.sum(w**2)
+        else:
+            raise ValueError('method should be one of chain or importance')
+        # bootstrap error:
+        num = len(diffs) if method == 'chain' else len(log_w)
+        if num_bootstrap > 0:
+            error = np.std([_estimate(np.random.randint(0, num, size=num)) for _ in range(num_bootstrap)])
+        else:
+            error = std / np.sqrt(ess)
+        #
+        return {'log_evidence': log_evidence, 'error': error, 'std': std, 'ess': ess}
+
     ###############################################################################
     # Information geometry methods:
 
-    @tf.function()
+    @_flow_function('coord')
     def map_to_abstract_coord(self, coord):
         """
         Map from parameter space to abstract space
         """
         return self.bijector.inverse(coord)
 
-    @tf.function()
+    @_flow_function('coord')
     def map_to_original_coord(self, coord):
         """
         Map from abstract space to parameter space
         """
         return self.bijector(coord)
 
-    @tf.function()
+    @_flow_function('coord')
     def log_det_metric(self, coord):
         """
         Computes the log determinant of the metric
@@ -702,7 +2055,7 @@ class DiffFlowCallback(Callback):
         else:
             return 2.*log_det
 
-    @tf.function()
+    @_flow_function('coord')
     def direct_jacobian(self, coord):
         """
         Computes the Jacobian of the parameter transformation at one point in (original) parameter space
@@ -713,7 +2066,7 @@ class DiffFlowCallback(Callback):
             f = self.map_to_original_coord(abs_coord)
         return tape.batch_jacobian(f, abs_coord)
 
-    @tf.function()
+    @_flow_function('coord')
     def inverse_jacobian(self, coord):
         """
         Computes the inverse Jacobian of the parameter transformation at one point in (original) parameter space
@@ -723,7 +2076,7 @@ class DiffFlowCallback(Callback):
             f = self.map_to_abstract_coord(coord)
         return tape.batch_jacobian(f, coord)
 
-    @tf.function()
+    @_flow_function('coord')
     def inverse_jacobian_coord_derivative(self, coord):
         """
         Compute the coordinate derivative of the inverse Jacobian at a given point in (original) parameter space
@@ -733,53 +2086,31 @@ class DiffFlowCallback(Callback):
             f = self.inverse_jacobian(coord)
         return tape.batch_jacobian(f, coord)
 
-    @tf.function()
+    @_flow_function('coord')
     def metric(self, coord):
         """
-        Computes the metric at a given point or array of points in (original) parameter space
+        Computes the metric at a given point or array of points in (original) parameter space, see :meth:`geometry_first_order_kernel`
         """
-        # compute Jacobian:
-        jac = self.inverse_jacobian(coord)
-        # take the transpose (we need to calculate the indexes that we want to swap):
-        trailing_axes = [-1, -2]
-        leading = tf.range(tf.rank(jac) - len(trailing_axes))
-        trailing = trailing_axes + tf.rank(jac)
-        new_order = tf.concat([leading, trailing], axis=0)
-        jac_T = tf.transpose(jac, new_order)
-        # compute metric:
-        metric = tf.linalg.matmul(jac_T, jac)
-        #
-        return metric
+        return self.geometry_first_order_kernel(coord)[1]
 
-    @tf.function()
+    @_flow_function('coord')
     def inverse_metric(self, coord):
         """
-        Computes the inverse metric at a given point or array of points in (original) parameter space
+        Computes the inverse metric at a given point or array of points in (original) parameter space, see :meth:`geometry_first_order_kernel`
         """
-        # compute Jacobian:
-        jac = self.direct_jacobian(coord)
-        # take the transpose (we need to calculate the indexes that we want to swap):
-        trailing_axes = [-1, -2]
-        leading = tf.range(tf.rank(jac) - len(trailing_axes))
-        trailing = trailing_axes + tf.rank(jac)
-        new_order = tf.concat([leading, trailing], axis=0)
-        jac_T = tf.transpose(jac, new_order)
-        # compute metric:
-        metric = tf.linalg.matmul(jac, jac_T)
-        #
-        return metric
+        return self.geometry_first_order_kernel(coord)[2]
 
-    @tf.function()
+    @_flow_function('coord')
     def coord_metric_derivative(self, coord):
         """
-        Compute the coordinate derivative of the metric at a given point in (original) parameter space
+        Compute the coordinate derivative of the metric at a given point in (original) parameter space, gives d_k g_ij with index order (i, j, k).
+        This follows from the metric and the Levi-Civita connection of :meth:`geometry_kernel`, since the connection is metric compatible: d_k g_ij = Gamma^l_k_i g_lj + Gamma^l_k_j g_il.
         """
-        with tf.GradientTape(watch_accessed_variables=False, persistent=True) as tape:
-            tape.watch(coord)
-            f = self.metric(coord)
-        return tape.batch_jacobian(f, coord)
+        _, metric, _, connection = self.geometry_kernel(coord)
+        #
+        return tf.einsum("...lki, ...lj -> ...ijk", connection, metric) + tf.einsum("...lkj, ...il -> ...ijk", connection, metric)
 
-    @tf.function()
+    @_flow_function('coord')
     def coord_inverse_metric_derivative(self, coord):
         """
         Compute the coordinate derivative of the inverse metric at a given point in (original) parameter space
@@ -789,7 +2120,7 @@ class DiffFlowCallback(Callback):
             f = self.inverse_metric(coord)
         return tape.batch_jacobian(f, coord)
 
-    @tf.function()
+    @_flow_function('coord')
     def coord_metric_derivative_2(self, coord):
         """
         Compute the second coordinate derivative of the metric at a given point in (original) parameter space
@@ -799,7 +2130,7 @@ class DiffFlowCallback(Callback):
             f = self.coord_metric_derivative(coord)
         return tape.batch_jacobian(f, coord)
 
-    @tf.function()
+    @_flow_function('coord')
     def coord_inverse_metric_derivative_2(self, coord):
         """
         Compute the second coordinate derivative of the inverse metric at a given point in (original) parameter space
@@ -809,10 +2140,182 @@ class DiffFlowCallback(Callback):
             f = self.coord_inverse_metric_derivative(coord)
         return tape.batch_jacobian(f, coord)
 
-    @tf.function()
+    def _map_point_chunks(self, fn, coord, num_tangents, output_dims, memory_budget=2**28):
+        """
+        Applies `fn` to an array of points in (original) parameter space in chunks, one at a time, so that the `num_tangents` copies of each point that forward mode derivatives stack along the batch dimension fit in `memory_budget` bytes.
+        Chunks are filled up with the last point, the outputs of `fn` have, per point, the number of dimensions of size `num_params` given in `output_dims`, and are returned with the batch shape of `coord`.
+        """
+        d = self.num_params
+        # chunk size, with some room for the intermediate results of the bijector:
+        bytes_per_point = 8 * num_tangents * d * np.dtype(self.np_prec).itemsize
+        points_per_chunk = max(1, int(memory_budget // bytes_per_point))
+        # split the points in chunks:
+        batch_shape = tf.shape(coord)[:-1]
+        x = tf.reshape(coord, [-1, d])
+        num_points = tf.shape(x)[0]
+        chunk = tf.maximum(tf.minimum(points_per_chunk, num_points), 1)
+        num_chunks = (num_points + chunk - 1) // chunk
+        x = tf.concat([x, tf.repeat(x[-1:], num_chunks*chunk - num_points, axis=0)], axis=0)
+        x = tf.reshape(x, [num_chunks, chunk, d])
+        # evaluate:
+        signature = tuple(tf.TensorSpec([None] + [d]*dims, self.prec) for dims in output_dims)
+        results = tf.map_fn(fn, x, fn_output_signature=signature, parallel_iterations=1)
+        # restore batch shape:
+        results = [tf.reshape(res, tf.concat([[-1], [d]*dims], axis=0))[:num_points] for res, dims in zip(results, output_dims)]
+        #
+        return tuple(tf.reshape(res, tf.concat([batch_shape, [d]*dims], axis=0)) for res, dims in zip(results, output_dims))
+
+    @_flow_function('coord')
+    def geometry_first_order_kernel(self, coord):
+        """
+        Computes, in a single pass, the inverse Jacobian, the metric and the inverse metric at a given array of points in (original) parameter space.
+        This is the first order part of :meth:`geometry_kernel`, the Jacobian of the map to abstract space is computed in forward mode, in chunks of points.
+        """
+        d = self.num_params
+        eye = np.eye(d)
+
+        def _kernel(x):
+            num_points = tf.shape(x)[0]
+            # stack points and tangent directions:
+            x = tf.reshape(tf.repeat(x[:, None, :], d, axis=1), [-1, d])
+            tangent = tf.tile(self.cast(eye), [num_points, 1])
+            with tf.autodiff.ForwardAccumulator(x, tangent) as acc:
+                abs_coord = self.bijector.inverse(x)
+            jac = tf.linalg.matrix_transpose(tf.reshape(acc.jvp(abs_coord), [num_points, d, d]))
+            # metric and inverse metric:
+            metric = tf.linalg.matmul(jac, jac, transpose_a=True)
+            inv_jac = tf.linalg.inv(jac)
+            inv_metric = tf.linalg.matmul(inv_jac, inv_jac, transpose_b=True)
+            #
+            return jac, metric, inv_metric
+        #
+        return self._map_point_chunks(_kernel, coord, d, [2, 2, 2])
+
+    @_flow_function('coord')
+    def geometry_kernel(self, coord):
+        """
+        Computes, in a single pass, the inverse Jacobian, the metric, the inverse metric and the Levi-Civita connection at a given array of points in (original) parameter space.
+
+        The metric is the pull back of the Euclidean metric in abstract space so all these quantities follow from the first and second derivatives of the map to abstract space.
+        These are computed in forward mode, stacking the tangent directions along the batch dimension, and the connection is obtained in closed form as Gamma^i_j_k = (J^-1)^i_a d_j d_k Z^a.
+        Points are processed in chunks so that the d(d+1)/2 copies of each point fit in memory.
+        """
+        d = self.num_params
+        # pairs of coordinate directions (j <= k), the first d pairs are (0, k):
+        j_ind, k_ind = np.triu_indices(d)
+        num_pairs = len(j_ind)
+        pair_index = np.zeros((d, d), dtype=np.int32)
+        pair_index[j_ind, k_ind] = np.arange(num_pairs)
+        pair_index[k_ind, j_ind] = np.arange(num_pairs)
+        eye = np.eye(d)
+
+        def _kernel(x):
+            num_points = tf.shape(x)[0]
+            # stack points and tangent directions:
+            x = tf.reshape(tf.repeat(x[:, None, :], num_pairs, axis=1), [-1, d])
+            tangent_j = tf.tile(self.cast(eye[j_ind]), [num_points, 1])
+            tangent_k = tf.tile(self.cast(eye[k_ind]), [num_points, 1])
+            # first and second derivatives of the map to abstract space:
+            with tf.autodiff.ForwardAccumulator(x, tangent_j) as outer:
+                with tf.autodiff.ForwardAccumulator(x, tangent_k) as inner:
+                    abs_coord = self.bijector.inverse(x)
+                d_abs_coord = inner.jvp(abs_coord)
+            dd_abs_coord = outer.jvp(d_abs_coord)
+            d_abs_coord = tf.reshape(d_abs_coord, [num_points, num_pairs, d])
+            dd_abs_coord = tf.reshape(dd_abs_coord, [num_points, num_pairs, d])
+            # inverse Jacobian and second derivatives:
+            jac = tf.linalg.matrix_transpose(d_abs_coord[:, :d, :])
+            hessian = tf.gather(dd_abs_coord, pair_index, axis=1)
+            # metric and inverse metric:
+            metric = tf.linalg.matmul(jac, jac, transpose_a=True)
+            inv_jac = tf.linalg.inv(jac)
+            inv_metric = tf.linalg.matmul(inv_jac, inv_jac, transpose_b=True)
+            # connection:
+            connection = tf.einsum("...ia, ...jka -> ...ijk", inv_jac, hessian)
+            #
+            return jac, metric, inv_metric, connection
+        #
+        return self._map_point_chunks(_kernel, coord, num_pairs, [2, 2, 2, 3])
+
+    def geometry(self, coord, batch_size=1000):
+        """
+        Evaluates :meth:`geometry_kernel` on an array of points in (original) parameter space, in chunks of `batch_size` points to bound memory usage.
+
+        :param coord: array of points with shape (N, D).
+        :param batch_size: number of points per chunk, defaults to 1000.
+        :type batch_size: int, optional
+        :return: inverse Jacobian, metric, inverse metric and connection as numpy arrays.
+        """
+        coord = self.cast(coord)
+        results = [self.geometry_kernel(coord[i:i+batch_size]) for i in range(0, coord.shape[0], batch_size)]
+        #
+        return tuple(np.concatenate([res[i].numpy() for res in results], axis=0) for i in range(4))
+
+    @_flow_function('coord')
+    def _grid_kernel(self, coord):
+        """
+        Computes log probability, log determinant of the metric, metric and its eigenvalues and eigenvectors on a batch of points.
+        """
+        log_prob = self.log_probability(coord)
+        log_det = self.log_det_metric(coord)
+        metric = self.metric(coord)
+        eig, eigv = tf.linalg.eigh(metric)
+        #
+        return log_prob, log_det, metric, eig, eigv
+
+    def grid_evaluation(self, *axes, memory_budget=2**28, cache=True):
+        """
+        Evaluates the flow on the grid spanned by the given axes, in one chunked and compiled pass.
+        Results are cached on the flow for each grid and set of weights so that different plots can reuse one evaluation.
+
+        :param axes: one array of points per parameter. The grid follows :func:`numpy.meshgrid` so, in 2D, results have shape (len(y), len(x)).
+        :param memory_budget: approximate memory, in bytes, that a chunk of points can use, defaults to 2**28.
+        :type memory_budget: int, optional
+        :param cache: whether to cache the results, defaults to True.
+        :type cache: bool, optional
+        :return: a dictionary with the grid shaped arrays of `log_probability`, `log_det_metric`, `metric`, `metric_eigenvalues` and `metric_eigenvectors`.
+        """
+        # check the cache, the key depends on the grid and on the current weights:
+        sha = hashlib.sha256()
+        for ax in axes:
+            sha.update(np.ascontiguousarray(ax, dtype=np.float64).tobytes()+b'|')
+        key = sha.hexdigest()+self._weights_key()
+        if not hasattr(self, '_grid_cache'):
+            self._grid_cache = {}
+        if cache and key in self._grid_cache:
+            return self._grid_cache[key]
+        # build the grid:
+        grid = np.meshgrid(*axes)
+        grid_shape = grid[0].shape
+        coords = np.stack([g.ravel() for g in grid], axis=-1).astype(self.np_prec)
+        # chunk size from the memory used by each point, with some room for the intermediate Jacobians:
+        bytes_per_point = 8 * (2*self.num_params**2 + self.num_params + 2) * np.dtype(self.np_prec).itemsize
+        batch_size = max(1, int(memory_budget // bytes_per_point))
+        # evaluate:
+        results = [self._grid_kernel(self.cast(coords[i:i+batch_size])) for i in range(0, coords.shape[0], batch_size)]
+        names = ['log_probability', 'log_det_metric', 'metric', 'metric_eigenvalues', 'metric_eigenvectors']
+        out = {}
+        for i, name in enumerate(names):
+            temp = np.concatenate([res[i].numpy() for res in results], axis=0)
+            out[name] = temp.reshape(grid_shape + temp.shape[1:])
+        # cache:
+        if cache:
+            self._grid_cache[key] = out
+        #
+        return out
+
+    @_flow_function('coord')
     def levi_civita_connection(self, coord):
         """
-        Compute the Levi-Civita connection, gives Gamma^i_j_k
+        Compute the Levi-Civita connection, gives Gamma^i_j_k, see :meth:`geometry_kernel`
+        """
+        return self.geometry_kernel(coord)[3]
+
+    @_flow_function('coord')
+    def levi_civita_connection_from_metric(self, coord):
+        """
+        Compute the Levi-Civita connection from the coordinate derivative of the metric, gives Gamma^i_j_k.
+        This is slower than :meth:`levi_civita_connection` and is kept as a reference implementation.
         """
         inv_metric = self.inverse_metric(coord)
         metric_derivative = self.coord_metric_derivative(coord)
@@ -880,34 +2383,190 @@ class DiffFlowCallback(Callback):
         #
         return results
 
-    @tf.function()
+    @_flow_function('coord', 'coord')
     def geodesic_distance(self, coord_1, coord_2):
         """
+        Geodesic distance between (batches of) points in (original) parameter space.
         """
         # map to abstract coordinates:
         abs_coord_1 = self.map_to_abstract_coord(coord_1)
         abs_coord_2 = self.map_to_abstract_coord(coord_2)
         # metric there is Euclidean:
-        return tf.linalg.norm(abs_coord_1 - abs_coord_2)
+        return tf.linalg.norm(abs_coord_1 - abs_coord_2, axis=-1)
 
-    @tf.function()
-    def fast_geodesic_ivp(self, pos, velocity, solution_times):
+    def pairwise_geodesic_distance(self, coord_1, coord_2=None, batch_size=10000):
+        """
+        Geodesic distance between all pairs of points in two arrays of points in (original) parameter space.
+        Points are mapped to abstract space once, in chunks of `batch_size`, where the metric is Euclidean.
+
+        :param coord_1: first array of points, with shape (N, D).
+        :param coord_2: second array of points, with shape (M, D). If None the distances between points in `coord_1` are computed.
+        :param batch_size: number of points that are mapped to abstract space at once, defaults to 10000.
+        :type batch_size: int, optional
+        :return: array of distances with shape (N, M).
+        """
+        def _to_abstract(coord):
+            coord = self.cast(coord)
+            return np.concatenate([self.map_to_abstract_coord(coord[i:i+batch_size]).numpy() for i in range(0, coord.shape[0], batch_size)], axis=0)
+        abs_coord_1 = _to_abstract(coord_1)
+        if coord_2 is None:
+            abs_coord_2 = abs_coord_1
+        else:
+            abs_coord_2 = _to_abstract(coord_2)
+        #
+        return cdist(abs_coord_1, abs_coord_2)
+
+    def _batch_geodesic_ode(self, y, carry, connection=None):
         """
+        Right hand side of the geodesic equation for a batch of states with shape (N, 2D), stacking position and velocity.
+        Uses the Levi-Civita connection of the flow unless another `connection` function is given.
         """
-        pass
+        if connection is None:
+            connection = self.levi_civita_connection
+        # unpack position and velocity:
+        pos = y[:, :self.num_params]
+        vel = y[:, self.num_params:]
+        # compute geodesic equation:
+        acc = -tf.einsum("...ijk, ...j, ...k -> ...i", connection(pos), vel, vel)
+        #
+        return tf.concat([vel, acc], axis=-1), carry
 
-    @tf.function()
+    @_flow_function('coord', 'coord', 'times')
+    def fast_geodesic_ivp(self, pos, velocity, solution_times, num_substeps=1):
+        """
+        Solve the geodesic equation for a batch of starting points and velocities in (original) parameter space.
+        All geodesics are integrated at once with a fixed step RK4 scheme that runs inside a :func:`tf.function`, the connection is evaluated on the whole batch at each stage.
+        Inputs are cast to the flow precision, a single point gives solutions without the batch dimension.
+
+        :param pos: starting points, with shape (N, D).
+        :param velocity: initial velocities, with shape (N, D).
+        :param solution_times: output times, the first one is the initial time.
+        :param num_substeps: number of RK4 steps between two output times, defaults to 1.
+        :type num_substeps: int, optional
+        :return: positions and velocities along the geodesics, with shape (N, T, D).
+        """
+        # prepare initial conditions:
+        y0 = tf.concat([pos, velocity], axis=-1)
+        carry = tf.zeros_like(y0[:, :1])
+        # solve:
+        traj, _, _ = _fixed_step_rk4(self._batch_geodesic_ode, y0, carry, solution_times, num_substeps=num_substeps)
+        traj = tf.transpose(traj, [1, 0, 2])
+        #
+        return traj[..., :self.num_params], traj[..., self.num_params:]
+
+    @_flow_function('coord', 'coord', 'times')
     def fast_geodesic_bvp(self, pos_start, pos_end, solution_times):
         """
+        Geodesics between batches of pairs of points in (original) parameter space.
+        The metric is the pull back of the Euclidean metric in abstract space so geodesics are straight lines there, that are mapped back to parameter space.
+        The velocity is pushed forward along the same pass in forward mode.
+        Inputs are cast to the flow precision, a single pair of points gives solutions without the batch dimension.
+
+        :param pos_start: starting points, with shape (N, D).
+        :param pos_end: end points, with shape (N, D).
+        :param solution_times: output times, the first and last ones correspond to the start and end points.
+        :return: positions and velocities along the geodesics, with shape (N, T, D).
+        """
+        num_times = tf.shape(solution_times)[0]
+        # straight line in abstract space:
+        abs_start = self.map_to_abstract_coord(pos_start)
+        abs_end = self.map_to_abstract_coord(pos_end)
+        duration = solution_times[-1] - solution_times[0]
+        abs_vel = (abs_end - abs_start) / duration
+        abs_traj = abs_start[:, None, :] + (solution_times - solution_times[0])[None, :, None] * abs_vel[:, None, :]
+        # map back to parameter space, together with the velocity:
+        abs_traj = tf.reshape(abs_traj, [-1, self.num_params])
+        abs_vel = tf.reshape(tf.repeat(abs_vel[:, None, :], num_times, axis=1), [-1, self.num_params])
+        with tf.autodiff.ForwardAccumulator(abs_traj, abs_vel) as acc:
+            traj = self.map_to_original_coord(abs_traj)
+        vel = acc.jvp(traj)
+        # restore shape:
+        shape = [-1, num_times, self.num_params]
+        #
+        return tf.reshape(traj, shape), tf.reshape(vel, shape)
+
+    def metric_connection(self, metric):
         """
-        pass
+        Build the Levi-Civita connection of a generic metric, to be used with :meth:`refine_geodesic_bvp`.
+        The derivatives of the metric are computed with automatic differentiation, so the metric has to be a differentiable tensorflow function.
+
+        A typical use is the metric of the likelihood, obtained removing the metric of a flow trained on the prior:
+
+        .. code-block:: python
+
+            connection = flow.metric_connection(lambda x: flow.metric(x) - prior_flow.metric(x))
+            traj, vel = flow.refine_geodesic_bvp(pos_start, pos_end, solution_times, connection)
+
+        The connection is cached for each metric, so that building it again for the same metric (the same function, or the same lambda) gives the same function, and :meth:`refine_geodesic_bvp` is not compiled again.
+
+        :param metric: function returning the metric, with shape (N, D, D), on a batch of points in (original) parameter space.
+        :return: function returning the connection Gamma^i_j_k, with shape (N, D, D, D), on a batch of points.
+        """
+        # check the cache, the metric is kept alive with the connection:
+        connections = self.__dict__.setdefault('_metric_connections', {})
+        key = _function_identity(metric)
+        if key in connections:
+            return connections[key][1]
+
+        def connection(coord):
+            with tf.GradientTape(watch_accessed_variables=False) as tape:
+                tape.watch(coord)
+                _metric = metric(coord)
+            # derivative of the metric, d_l g_jk with indexes ordered as j, k, l:
+            metric_derivative = tape.batch_jacobian(_metric, coord)
+            # Gamma^i_kl = 1/2 g^ij (d_k g_jl + d_l g_jk - d_j g_kl):
+            temp = tf.einsum("...jlk -> ...jkl", metric_derivative) + metric_derivative - tf.einsum("...klj -> ...jkl", metric_derivative)
+            return 0.5*tf.einsum("...ij, ...jkl -> ...ikl", tf.linalg.inv(_metric), temp)
+        connections[key] = (metric, connection)
+        #
+        return connection
+
+    @_flow_function('coord', 'coord', 'times')
+    def refine_geodesic_bvp(self, pos_start, pos_end, solution_times, connection, num_iterations=5, num_substeps=1):
+        """
+        Geodesics between batches of pairs of points in (original) parameter space for a metric that is not the one of the flow, like one that includes a non-trivial prior.
+        The initial velocities are obtained from :meth:`fast_geodesic_bvp` and refined with a batched Newton shooting scheme on top of the compiled RK4 integrator.
+        For the metric of the flow itself the initial guess is already the geodesic, so the connection has to be given, see :meth:`metric_connection`.
+
+        :param pos_start: starting points, with shape (N, D).
+        :param pos_end: end points, with shape (N, D).
+        :param solution_times: output times, the first and last ones correspond to the start and end points.
+        :param connection: function returning the connection on a batch of points, see :meth:`metric_connection`.
+        :param num_iterations: number of Newton iterations, defaults to 5.
+        :type num_iterations: int, optional
+        :param num_substeps: number of RK4 steps between two output times, defaults to 1.
+        :type num_substeps: int, optional
+        :return: positions and velocities along the geodesics, with shape (N, T, D).
+        """
+        def _rhs(y, carry):
+            return self._batch_geodesic_ode(y, carry, connection)
+
+        def _shoot(velocity):
+            y0 = tf.concat([pos_start, velocity], axis=-1)
+            traj, _, _ = _fixed_step_rk4(_rhs, y0, tf.zeros_like(y0[:, :1]), solution_times, num_substeps=num_substeps)
+            return tf.transpose(traj, [1, 0, 2])
+        # initial guess from the flow geodesics:
+        _, vel = self.fast_geodesic_bvp(pos_start, pos_end, solution_times)
+        velocity = vel[:, 0, :]
+        # Newton iterations on the end point:
+        for _ in range(num_iterations):
+            with tf.GradientTape(watch_accessed_variables=False) as tape:
+                tape.watch(velocity)
+                end = _shoot(velocity)[:, -1, :self.num_params]
+            jac = tape.batch_jacobian(end, velocity)
+            step = tf.linalg.solve(jac, (end - pos_end)[..., None])[..., 0]
+            velocity = velocity - tf.where(tf.math.is_finite(step), step, tf.zeros_like(step))
+        # final solution:
+        traj = _shoot(velocity)
+        #
+        return traj[..., :self.num_params], traj[..., self.num_params:]
 
     def _naive_eigenvalue_ode_abs(self, t, y, reference):
         """
         Solve naively the dynamical equation for eigenvalues in abstract space.
         """
         # preprocess:
-        x = tf.convert_to_tensor([tf.cast(y, tf.float32)])
+        x = tf.convert_to_tensor([self.cast(y)])
         # map to original space to compute Jacobian (without inversion):
         x_par = self.map_to_original_coord(x)
         # precompute Jacobian and its derivative:
@@ -1022,6 +2681,90 @@ class DiffFlowCallback(Callback):
         #
         return times, traj
 
+    def _batch_eigenvalue_ode_abs(self, y, reference):
+        """
+        Right hand side of the eigenvalue ODE in abstract space, for a batch of points and reference directions.
+        """
+        # map to original space to compute Jacobian (without inversion):
+        x_par = self.map_to_original_coord(y)
+        jac = self.inverse_jacobian(x_par)
+        jac_jac_T = tf.linalg.matmul(jac, jac, transpose_b=True)
+        # compute eigenvalues:
+        eig, eigv = tf.linalg.eigh(jac_jac_T)
+        # select the eigenvector that is closest to the reference:
+        temp = tf.einsum('...ik, ...i -> ...k', eigv, reference)
+        idx = tf.math.argmax(tf.abs(temp), axis=-1)
+        sign = tf.math.sign(tf.gather(temp, idx, axis=1, batch_dims=1))
+        w = sign[:, None] * tf.gather(eigv, idx, axis=2, batch_dims=1)
+        #
+        return w, w
+
+    @_flow_function('coord', 'coord', 'times')
+    def _solve_batch_eigenvalue_ode_abs(self, y0, reference, solution_times, num_substeps=1):
+        """
+        Compiled integration of the eigenvalue ODE in abstract space.
+        """
+        traj, vel, _ = _fixed_step_rk4(self._batch_eigenvalue_ode_abs, y0, reference, solution_times, num_substeps=num_substeps)
+        #
+        return tf.transpose(traj, [1, 0, 2]), tf.transpose(vel, [1, 0, 2])
+
+    def solve_batch_eigenvalue_ode_abs(self, y0, n, length=1.5, side='both', num_points=100, num_substeps=1):
+        """
+        Solve the eigenvalue problem in abstract space for a batch of starting points.
+        All starting points and both sides are integrated at once, with a fixed step RK4 scheme that runs inside a :func:`tf.function`.
+
+        :param y0: starting points in abstract space, with shape (N, D) or (D).
+        :param n: index of the eigenvector to follow. Either an integer or an array with one index per starting point.
+        :param length: length of the trajectories, defaults to 1.5.
+        :param side: which side to integrate, '+', '-' or 'both', defaults to 'both'.
+        :param num_points: number of output points on each side, defaults to 100.
+        :param num_substeps: number of RK4 steps between two output points, defaults to 1.
+        :return: times, trajectories and velocities. The trajectories and velocities have shape (N, T, D), or (T, D) if a single starting point is given.
+        """
+        # prepare initial points:
+        y0 = self.cast(y0)
+        single = len(y0.shape) == 1
+        if single:
+            y0 = y0[None, :]
+        n = np.broadcast_to(n, (y0.shape[0],))
+        # define solution points:
+        solution_times = tf.linspace(0., length, num_points)
+        # compute initial PCA:
+        jac = self.inverse_jacobian(self.map_to_original_coord(y0))
+        eig, eigv = tf.linalg.eigh(tf.linalg.matmul(jac, jac, transpose_b=True))
+        reference = tf.gather(eigv, n, axis=2, batch_dims=1)
+        # stack the two sides:
+        if side == '+':
+            pass
+        elif side == '-':
+            reference = -reference
+        elif side == 'both':
+            y0 = tf.concat([y0, y0], axis=0)
+            reference = tf.concat([reference, -reference], axis=0)
+        else:
+            raise ValueError('side should be one of +, - or both')
+        # solve:
+        traj, vel = self._solve_batch_eigenvalue_ode_abs(y0, reference, self.cast(solution_times), num_substeps=num_substeps)
+        times, traj, vel = _patch_two_sided_solution(solution_times.numpy(), traj.numpy(), vel.numpy(), side)
+        #
+        if single:
+            return times, traj[0], vel[0]
+        return times, traj, vel
+
+    def solve_batch_eigenvalue_ode_par(self, y0, n, **kwargs):
+        """
+        Solve the eigenvalue ODE in parameter space for a batch of starting points.
+        Takes the same arguments as :meth:`solve_batch_eigenvalue_ode_abs`.
+        """
+        # go to abstract space:
+        x_abs = self.map_to_abstract_coord(self.cast(y0))
+        # call solver:
+        times, traj, vel = self.solve_batch_eigenvalue_ode_abs(x_abs, n, **kwargs)
+        # convert back:
+        traj = self.map_to_original_coord(self.cast(np.reshape(traj, (-1, self.num_params)))).numpy().reshape(traj.shape)
+        #
+        return times, traj
+
     # solve full transport in abstract space:
     @tf.function()
     def eigenvalue_ode_abs_temp_3(self, t, y):
@@ -1059,7 +2802,7 @@ class DiffFlowCallback(Callback):
     # Training statistics:
 
     def _compute_shift_proba(self):
-        zero = np.array(self.bijector.inverse(np.zeros(self.num_params, dtype=np_prec)))
+        zero = np.array(self.bijector.inverse(np.zeros(self.num_params, dtype=self.np_prec)))
         chi2Z0 = np.sum(zero**2)
         pval = scipy.stats.chi2.cdf(chi2Z0, df=self.num_params)
         nsigma = utils.from_confidence_to_sigma(pval)
@@ -1078,7 +2821,8 @@ class DiffFlowCallback(Callback):
 
     def _plot_chi2_dist(self, ax, logs={}):
         # Compute chi2 and make sure some are finite
-        chi2Z = np.sum(np.array(self.trainable_bijector.inverse(self.samples_test))**2, axis=1)
+        chi2Z = self._diagnostics_chi2Z(self.cast(self._diagnostics_samples_test)).numpy()
+        weights_test = self._diagnostics_weights_test
         _s = np.isfinite(chi2Z)
         assert np.any(_s)
         chi2Z = chi2Z[_s]
@@ -1087,7 +2831,7 @@ class DiffFlowCallback(Callback):
         try:
             # Note that scipy.stats.kstest does not handle weights yet so we need to resample.
             if self.has_weights:
-                chi2Z = np.random.choice(chi2Z, size=len(chi2Z), replace=True, p=self.weights_test[_s]/np.sum(self.weights_test[_s]))
+                chi2Z = np.random.choice(chi2Z, size=len(chi2Z), replace=True, p=weights_test[_s]/np.sum(weights_test[_s]))
             chi2Z_ks, chi2Z_ks_p = scipy.stats.kstest(chi2Z, 'chi2', args=(self.num_params,))
         except:
             chi2Z_ks, chi2Z_ks_p = 0., 0.
@@ -1102,7 +2846,7 @@ class DiffFlowCallback(Callback):
         if ax is not None:
             ax.plot(xx, scipy.stats.chi2.pdf(xx, df=self.num_params), label='$\\chi^2_{{{}}}$ PDF'.format(self.num_params), c='k', lw=1)
             ax.hist(self.chi2Y, bins=bins, density=True, histtype='step', weights=self.weights_test, label='Pre-gauss ($D_n$={:.3f})'.format(self.chi2Y_ks))
-            ax.hist(chi2Z, bins=bins, density=True, histtype='step', weights=self.weights_test[_s], label='Post-gauss ($D_n$={:.3f})'.format(chi2Z_ks))
+            ax.hist(chi2Z, bins=bins, density=True, histtype='step', weights=weights_test[_s], label='Post-gauss ($D_n$={:.3f})'.format(chi2Z_ks))
             ax.set_title(r'$\chi^2_{{{}}}$ PDF'.format(self.num_params))
             ax.set_xlabel(r'$\chi^2$')
             ax.legend(fontsize=8)
@@ -1110,13 +2854,13 @@ class DiffFlowCallback(Callback):
     def _plot_chi2_ks_p(self, ax, logs={}):
         # Plot
         if ax is not None:
-            ln1 = ax.plot(self.log["chi2Z_ks_p"], label='$p$')
+            ln1 = ax.plot(self.log["diagnostics_epoch"], self.log["chi2Z_ks_p"], label='$p$')
             ax.set_title(r"KS test ($\chi^2$)")
             ax.set_xlabel("Epoch #")
             ax.set_ylabel(r"$p$-value")
 
             ax2 = ax.twinx()
-            ln2 = ax2.plot(self.log["chi2Z_ks"], ls='--', label='$D_n$')
+            ln2 = ax2.plot(self.log["diagnostics_epoch"], self.log["chi2Z_ks"], ls='--', label='$D_n$')
             ax2.set_ylabel(r'$D_n$')
 
             lns = ln1+ln2
@@ -1124,19 +2868,21 @@ class DiffFlowCallback(Callback):
             ax2.legend(lns, labs, loc=1)
 
     def _plot_evidence_error(self, ax, logs={}):
-        # compute evidence:
-        evidence, evidence_error = self.evidence()
+        # compute evidence, the weight independent part of the terms is cached:
+        diffs, weights = self._evidence_terms(diagnostics=True)
+        evidence = np.average(diffs, weights=weights)
+        evidence_error = np.sqrt(np.average((diffs-evidence)**2, weights=weights))
         self.log["evidence"].append(evidence)
         self.log["evidence_error"].append(evidence_error)
         # plot:
         if ax is not None:
-            ln1 = ax.plot(self.log["evidence_error"], label='var $\\mathcal{E}$')
+            ln1 = ax.plot(self.log["diagnostics_epoch"], self.log["evidence_error"], label='var $\\mathcal{E}$')
             ax.set_title(r"Flow evidence")
             ax.set_xlabel("Epoch #")
             ax.set_ylabel(r"Evidence error")
 
             ax2 = ax.twinx()
-            ln2 = ax2.plot(self.log["evidence"], ls='--', label='$\\mathcal{E}$')
+            ln2 = ax2.plot(self.log["diagnostics_epoch"], self.log["evidence"], ls='--', label='$\\mathcal{E}$')
             ax2.set_ylabel(r'Evidence')
 
             lns = ln1+ln2
@@ -1155,12 +2901,16 @@ class DiffFlowCallback(Callback):
             fig, axes = plt.subplots(1, 4, figsize=(16, 3))
         else:
             axes = [None]*4
+        run_diagnostics = bool(self.diagnostics_every) and epoch % self.diagnostics_every == 0
         self._plot_loss(axes[0], logs=logs)
-        self._plot_chi2_dist(axes[1], logs=logs)
+        if run_diagnostics:
+            with self._profile('train/diagnostics'):
+                self.log["diagnostics_epoch"].append(epoch)
+                self._plot_chi2_dist(axes[1], logs=logs)
+                self._plot_evidence_error(axes[3], logs=logs)
         self._plot_chi2_ks_p(axes[2], logs=logs)
-        self._plot_evidence_error(axes[3], logs=logs)
 
-        for k in self.log.keys():
+        for k in ["loss", "val_loss"] + (["chi2Z_ks", "chi2Z_ks_p", "evidence", "evidence_error"] if run_diagnostics else []):
             logs[k] = self.log[k][-1]
 
         if self.feedback and matplotlib.get_backend() != 'agg':
@@ -1220,7 +2970,7 @@ def _naive_KL_ode(t, y, reference, flow, prior_flow):
     Solve naively the dynamical equation for KL decomposition in abstract space.
     """
     # preprocess:
-    x = tf.convert_to_tensor([tf.cast(y, tf.float32)])
+    x = tf.convert_to_tensor([flow.cast(y)])
     # compute metrics:
     metric = flow.metric(x)[0]
     prior_metric = prior_flow.metric(x)[0]
@@ -1252,7 +3002,7 @@ def solve_KL_ode(flow, prior_flow, y0, n, length=1.5, side='both', integrator_op
     # define solution points:
     solution_times = tf.linspace(0., length, num_points)
     # compute initial KL decomposition:
-    x = tf.convert_to_tensor([tf.cast(y0, tf.float32)])
+    x = tf.convert_to_tensor([flow.cast(y0)])
     metric = flow.metric(x)[0]
     prior_metric = prior_flow.metric(x)[0]
     # compute KL decomposition:
@@ -1333,6 +3083,86 @@ def solve_KL_ode(flow, prior_flow, y0, n, length=1.5, side='both', integrator_op
     #
     return times, traj, vel
 
+
+def _batch_KL_ode(y, carry, flow, prior_flow):
+    """
+    Right hand side of the KL ODE for a batch of points. The carry contains the reference direction and the KL eigenvalues.
+    """
+    reference = carry[:, :flow.num_params]
+    # compute metrics:
+    metric = flow.metric(y)
+    prior_metric = prior_flow.metric(y)
+    # compute KL decomposition:
+    eig, eigv = tf_KL_decomposition(metric, prior_metric)
+    # normalize to one to project and select direction:
+    temp = tf.einsum('...ik, ...i -> ...k', eigv, reference) / tf.linalg.norm(eigv, axis=-2) / tf.linalg.norm(reference, axis=-1, keepdims=True)
+    idx = tf.math.argmax(tf.abs(temp), axis=-1)
+    sign = tf.math.sign(tf.gather(temp, idx, axis=1, batch_dims=1))
+    w = sign[:, None] * tf.gather(eigv, idx, axis=2, batch_dims=1)
+    # normalize affine parameter:
+    s = tf.math.sqrt(tf.einsum('...i, ...ij, ...j -> ...', w, metric, w))
+    w = w / s[:, None]
+    #
+    return w, tf.concat([w, eig], axis=-1)
+
+
+@tf.function
+def _solve_batch_KL_ode(flow, prior_flow, y0, carry, solution_times, num_substeps=1):
+    """
+    Compiled integration of the KL ODE.
+    This is internal and, since it involves two flows, is not a :class:`_flow_function`: it only takes canonical tensors, as prepared by :func:`solve_batch_KL_ode`.
+    These are the starting points, with shape (N, D), the carry, with shape (N, 2D), and the solution times in the precision of `flow`, while `num_substeps` is a python integer.
+    """
+    traj, vel, carry = _fixed_step_rk4(lambda y, c: _batch_KL_ode(y, c, flow, prior_flow), y0, carry, solution_times, num_substeps=num_substeps)
+    #
+    return tf.transpose(traj, [1, 0, 2]), tf.transpose(vel, [1, 0, 2]), tf.transpose(carry[..., flow.num_params:], [1, 0, 2])
+
+
+def solve_batch_KL_ode(flow, prior_flow, y0, n, length=1.5, side='both', num_points=100, num_substeps=1):
+    """
+    Solve the KL eigenvalue problem for a batch of starting points.
+    All trajectories are advanced in lockstep, with both metrics and the KL decomposition computed once per step for the whole batch, with a fixed step RK4 scheme that runs inside a :func:`tf.function`.
+
+    :param flow: the posterior flow.
+    :param prior_flow: the prior flow.
+    :param y0: starting points, with shape (N, D) or (D).
+    :param n: index of the KL mode to follow. Either an integer or an array with one index per starting point.
+    :param length: length of the trajectories, defaults to 1.5.
+    :param side: which side to integrate, '+', '-' or 'both', defaults to 'both'.
+    :param num_points: number of output points on each side, defaults to 100.
+    :param num_substeps: number of RK4 steps between two output points, defaults to 1.
+    :return: times, trajectories, velocities and KL eigenvalues along the trajectories. The last three have shape (N, T, D), or (T, D) if a single starting point is given.
+    """
+    # prepare initial points:
+    y0 = flow.cast(y0)
+    single = len(y0.shape) == 1
+    if single:
+        y0 = y0[None, :]
+    n = np.broadcast_to(n, (y0.shape[0],))
+    # define solution points:
+    solution_times = tf.linspace(0., length, num_points)
+    # compute initial KL decomposition:
+    eig, eigv = tf_KL_decomposition(flow.metric(y0), prior_flow.metric(y0))
+    reference = tf.gather(eigv, n, axis=2, batch_dims=1)
+    # stack the two sides:
+    if side == '+':
+        pass
+    elif side == '-':
+        reference = -reference
+    elif side == 'both':
+        y0 = tf.concat([y0, y0], axis=0)
+        reference = tf.concat([reference, -reference], axis=0)
+        eig = tf.concat([eig, eig], axis=0)
+    else:
+        raise ValueError('side should be one of +, - or both')
+    # solve:
+    traj, vel, eig = _solve_batch_KL_ode(flow, prior_flow, y0, tf.concat([reference, eig], axis=-1), flow.cast(solution_times), num_substeps=num_substeps)
+    times, traj, vel, eig = _patch_two_sided_solution(solution_times.numpy(), traj.numpy(), vel.numpy(), side, aux=eig.numpy())
+    #
+    if single:
+        return times, traj[0], vel[0], eig[0]
+    return times, traj, vel, eig
+
 ###############################################################################
 # Transformed flow:
 
@@ -1341,7 +3171,11 @@ class TransformedDiffFlowCallback(DiffFlowCallback):
 
     def __init__(self, flow, transformation):
 
+        self.profiler = None
+        self.sample_pool_dir = flow.sample_pool_dir
         self.num_params = flow.num_params
+        self.prec = flow.prec
+        self.np_prec = flow.np_prec
         if isinstance(transformation, Iterable):
             tmap = transformation
         else:
@@ -1392,3 +3226,303 @@ class TransformedDiffFlowCallback(DiffFlowCallback):
         else:
             self.MAP_coord = flow.MAP_coord
             self.MAP_logP = flow.MAP_logP
+
+###############################################################################
+# frozen flow artifacts:
+
+
+class _FrozenFlowModule(tf.Module):
+    """
+    Module holding the full bijector chain of a flow with the compiled functions that are exported.
+    """
+
+    def __init__(self, flow):
+        super(_FrozenFlowModule, self).__init__(name='frozen_flow')
+        self.distribution = flow.distribution
+        self.bijector = flow.bijector
+        spec = tf.TensorSpec(shape=[None, flow.num_params], dtype=flow.prec)
+        self.log_probability = tf.function(self._log_probability, input_signature=[spec])
+        self.map_to_abstract_coord = tf.function(self._map_to_abstract_coord, input_signature=[spec])
+        self.map_to_original_coord = tf.function(self._map_to_original_coord, input_signature=[spec])
+        self.metric = tf.function(self._metric, input_signature=[spec])
+        self.sample = tf.function(self._sample, input_signature=[tf.TensorSpec(shape=[], dtype=tf.int32)])
+
+    def _log_probability(self, coord):
+        return self.distribution.log_prob(coord)
+
+    def _map_to_abstract_coord(self, coord):
+        return self.bijector.inverse(coord)
+
+    def _map_to_original_coord(self, coord):
+        return self.bijector.forward(coord)
+
+    def _metric(self, coord):
+        with tf.GradientTape(watch_accessed_variables=False) as tape:
+            tape.watch(coord)
+            f = self.bijector.inverse(coord)
+        jac = tape.batch_jacobian(f, coord)
+        return tf.linalg.matmul(jac, jac, transpose_a=True)
+
+    def _sample(self, N):
+        return self.distribution.sample(N)
+
+
+def export_flow(flow, path):
+    """
+    Export a flow as a self-contained artifact: a SavedModel with the full bijector chain (prior bijector, Gaussian pre-whitening and trainable bijector) and concrete functions for `log_probability`, `sample`, `map_to_abstract_coord`, `map_to_original_coord` and `metric`, together with parameter names, labels, ranges and MAP.
+    The artifact can be loaded with :func:`load_frozen_flow` without the chain.
+
+    :param flow: a :class:`~.DiffFlowCallback`.
+    :param path: directory where to save.
+    :type path: str
+    """
+    module = _FrozenFlowModule(flow)
+    tf.saved_model.save(module, path)
+    metadata = {'num_params': flow.num_params,
+                'param_names': flow.param_names,
+                'param_labels': flow.param_labels,
+                'parameter_ranges': flow.parameter_ranges,
+                'name_tag': flow.name_tag,
+                'dtype': flow.prec.name,
+                'MAP_coord': flow.MAP_coord,
+                'MAP_logP': None if flow.MAP_logP is None else np.array(flow.MAP_logP),
+                }
+    pickle.dump(metadata, open(os.path.join(path, 'flow_metadata.pickle'), 'wb'))
+
+
+class FrozenFlow(object):
+    """
+    Lightweight, inference only, flow loaded from an artifact written by :func:`export_flow`.
+    It does not need the chain and exposes the same evaluation methods as :class:`~.DiffFlowCallback` for the exported functions.
+
+    :param path: directory of the artifact.
+    :type path: str
+    """
+
+    def __init__(self, path):
+        self._module = tf.saved_model.load(path)
+        metadata = pickle.load(open(os.path.join(path, 'flow_metadata.pickle'), 'rb'))
+        self.num_params = metadata['num_params']
+        self.param_names = metadata['param_names']
+        self.param_labels = metadata['param_labels']
+        self.parameter_ranges = metadata['parameter_ranges']
+        self.name_tag = metadata['name_tag']
+        self.prec = tf.as_dtype(metadata['dtype'])
+        self.np_prec = self.prec.as_numpy_dtype
+        self.MAP_coord = metadata['MAP_coord']
+        self.MAP_logP = metadata['MAP_logP']
+
+    def cast(self, v):
+        """
+        Cast vector to internal precision of the flow. Converts to tensorflow tensor.
+        """
+        return tf.cast(v, dtype=self.prec)
+
+    def _batch(self, function, coord):
+        """
+        Call an exported function on a point or an array of points.
+        """
+        coord = self.cast(coord)
+        if len(coord.shape) == 1:
+            return function(coord[None, :])[0]
+        return function(coord)
+
+    def log_probability(self, coord):
+        """
+        Returns learned log probability.
+        """
+        return self._batch(self._module.log_probability, coord)
+
+    def map_to_abstract_coord(self, coord):
+        """
+        Map from parameter space to abstract space
+        """
+        return self._batch(self._module.map_to_abstract_coord, coord)
+
+    def map_to_original_coord(self, coord):
+        """
+        Map from abstract space to parameter space
+        """
+        return self._batch(self._module.map_to_original_coord, coord)
+
+    def metric(self, coord):
+        """
+        Computes the metric at a given point or array of points in (original) parameter space
+        """
+        return self._batch(self._module.metric, coord)
+
+    def sample(self, N):
+        """
+        Return samples from the synthetic probablity.
+        """
+        return self._module.sample(tf.constant(N, dtype=tf.int32))
+
+    def MCSamples(self, size, logLikes=True, **kwargs):
+        """
+        Return MCSamples object from the syntetic probability.
+        """
+        samples = self.sample(size)
+        loglikes = -self.log_probability(samples).numpy() if logLikes else None
+        #
+        return MCSamples(samples=samples.numpy(), loglikes=loglikes,
+                         names=self.param_names, labels=self.param_labels,
+                         ranges=self.parameter_ranges,
+                         name_tag=self.name_tag, **kwargs)
+
+
+def load_frozen_flow(path):
+    """
+    Load a flow exported with :func:`export_flow`.
+
+    :param path: directory of the artifact.
+    :type path: str
+    :return: a :class:`~.FrozenFlow`.
+    """
+    return FrozenFlow(path)
+
+###############################################################################
+# persistent flow cache:
+
+
+def _cache_key_repr(obj):
+    """
+    Deterministic string representation of the flow settings that enter the cache key.
+    """
+    if isinstance(obj, dict):
+        return '{'+', '.join(str(k)+': '+_cache_key_repr(obj[k]) for k in sorted(obj.keys()))+'}'
+    elif isinstance(obj, (list, tuple)):
+        return '['+', '.join(_cache_key_repr(v) for v in obj)+']'
+    elif isinstance(obj, np.ndarray):
+        # arrays, possibly memory-mapped and large, are represented by their shape, type and a hash of their content:
+        return 'ndarray'+_cache_key_repr([obj.shape, obj.dtype.str])+hashlib.sha256(np.ascontiguousarray(obj).tobytes()).hexdigest()
+    elif tf.is_tensor(obj) or isinstance(obj, tf.Variable):
+        return _cache_key_repr(np.asarray(obj))
+    elif isinstance(obj, tfp.bijectors.Bijector):
+        # the constructor parameters (shifts, scales, bounds, nested bijectors) and the values of the variables of the bijector:
+        return type(obj).__name__+_cache_key_repr([obj.parameters, [var for var in obj.variables]])
+    elif hasattr(obj, 'get_config'):
+        return type(obj).__name__+_cache_key_repr(obj.get_config())
+    elif callable(obj):
+        return getattr(obj, '__name__', type(obj).__name__)
+    else:
+        return repr(obj)
+
+
+def flow_cache_key(chain, param_names=None, param_ranges=None, prior_bijector='ranges', apply_pregauss=True, **kwargs):
+    """
+    Computes the key of a flow in the flow cache.
+    This is a hash of the chain samples, weights and log likes, of the parameter names and ranges, of the bijector choices and of the MAF hyperparameters.
+    Takes the same arguments as :class:`~.DiffFlowCallback`.
+
+    :return: hexadecimal key.
+    """
+    if param_names is None:
+        param_names = chain.getParamNames().getRunningNames()
+    ind = [chain.index[name] for name in param_names]
+    sha = hashlib.sha256()
+    # chain:
+    for arr in [chain.samples[:, ind], chain.weights, chain.loglikes]:
+        if arr is not None:
+            sha.update(np.ascontiguousarray(arr, dtype=np.float64).tobytes())
+    # settings, profiling does not change the flow:
+    kwargs = {k: v for k, v in kwargs.items() if k != 'profile'}
+    sha.update(_cache_key_repr([param_names, param_ranges, prior_bijector, apply_pregauss, kwargs]).encode())
+    #
+    return sha.hexdigest()[:16]
+
+
+def save_flow(flow, path, key=None):
+    """
+    Save a trained flow in a flow cache directory, together with its permutations, metadata, MAP and training log.
+    Can be called again after finding the MAP to update the cache.
+
+    :param flow: a trained :class:`~.DiffFlowCallback` with a :class:`~.SimpleMAF` trainable bijector.
+    :param path: directory where to save.
+    :type path: str
+    :param key: cache key of the flow, defaults to None.
+    :type key: str, optional
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    flow.MAF.save(os.path.join(path, 'flow'))
+    metadata = {'key': key,
+                'name_tag': flow.name_tag,
+                'param_names': flow.param_names,
+                'parameter_ranges': flow.parameter_ranges,
+                'trainable_parameters': flow.model.count_params(),
+                'MAP_coord': flow.MAP_coord,
+                'MAP_logP': None if flow.MAP_logP is None else np.array(flow.MAP_logP),
+                'log': flow.log,
+                }
+    pickle.dump(metadata, open(os.path.join(path, 'metadata.pickle'), 'wb'))
+
+
+# settings of DiffFlowCallback that are not passed to SimpleMAF:
+_flow_settings = ['learning_rate', 'validation_split', 'diagnostics_every', 'diagnostics_samples', 'streaming', 'stream_source', 'ignore_rows', 'chunk_size', 'shuffle_buffer', 'split_seed', 'profile', 'precision']
+
+
+def load_flow(chain, cache_dir, param_names=None, param_ranges=None, prior_bijector='ranges', apply_pregauss=True, feedback=1, pop_size=None, train_kwargs=None, find_MAP=False, MAP_kwargs=None, **kwargs):
+    """
+    Get a trained :class:`~.DiffFlowCallback` from a persistent, content-addressed flow cache.
+    The flow is stored in a sub-directory of `cache_dir` named after :func:`flow_cache_key`. If a matching flow is found its weights, MAP and training log are restored, otherwise the flow is trained and saved.
+    Changing the chain, the parameters, their ranges, the bijectors or the MAF hyperparameters always results in a new key, so mismatched weights are never loaded.
+
+    :param chain: input chain.
+    :type chain: :class:`~getdist.mcsamples.MCSamples`
+    :param cache_dir: directory of the flow cache.
+    :type cache_dir: str
+    :param feedback: feedback level, defaults to 1.
+    :type feedback: int, optional
+    :param pop_size: if given the flow is trained with :meth:`~.DiffFlowCallback.global_train` with this population size, otherwise with :meth:`~.DiffFlowCallback.train`.
+    :type pop_size: int, optional
+    :param train_kwargs: dictionary of arguments for the training, defaults to None.
+    :type train_kwargs: dict, optional
+    :param find_MAP: whether to find the MAP of the flow, with :meth:`~.DiffFlowCallback.MAP_finder`, if it is not in the cache, and save it. Defaults to False.
+    :type find_MAP: bool, optional
+    :param MAP_kwargs: dictionary of arguments for :meth:`~.DiffFlowCallback.MAP_finder`, defaults to None.
+    :type MAP_kwargs: dict, optional
+    :param kwargs: other arguments for :class:`~.DiffFlowCallback` and :class:`~.SimpleMAF`. These enter the cache key.
+    :return: the flow and its cache key.
+    """
+    # get the key:
+    key = flow_cache_key(chain, param_names=param_names, param_ranges=param_ranges, prior_bijector=prior_bijector, apply_pregauss=apply_pregauss, **kwargs)
+    path = os.path.join(cache_dir, key)
+    # load:
+    if os.path.isfile(os.path.join(path, 'metadata.pickle')):
+        metadata = pickle.load(open(os.path.join(path, 'metadata.pickle'), 'rb'))
+        flow_kwargs = {k: v for k, v in kwargs.items() if k in _flow_settings}
+        maf_kwargs = {k: v for k, v in kwargs.items() if k not in flow_kwargs}
+        # the MAF is rebuilt in the precision of the cached flow:
+        precision = flow_kwargs.get('precision', None)
+        temp_MAF = SimpleMAF.load(len(metadata['param_names']), os.path.join(path, 'flow'), dtype=tf.as_dtype(prec if precision is None else precision), **maf_kwargs)
+        flow = DiffFlowCallback(chain, param_names=param_names, param_ranges=param_ranges,
+                                prior_bijector=prior_bijector, apply_pregauss=apply_pregauss,
+                                trainable_bijector=temp_MAF.bijector, feedback=feedback, **flow_kwargs)
+        flow.MAF = temp_MAF
+        flow._maf_kwargs = maf_kwargs
+        flow.MAP_coord = metadata['MAP_coord']
+        flow.MAP_logP = metadata['MAP_logP']
+        flow.log = metadata['log']
+        flow.is_trained = True
+        if feedback > 0:
+            print('Loaded flow', key, 'from', cache_dir)
+    # train and save:
+    else:
+        if train_kwargs is None:
+            train_kwargs = {}
+        flow = DiffFlowCallback(chain, param_names=param_names, param_ranges=param_ranges,
+                                prior_bijector=prior_bijector, apply_pregauss=apply_pregauss,
+                                feedback=feedback, **kwargs)
+        if pop_size is None:
+            flow.train(**train_kwargs)
+        else:
+            flow.global_train(pop_size=pop_size, **train_kwargs)
+        save_flow(flow, path, key=key)
+    # find the MAP and update the cache:
+    if find_MAP and flow.MAP_coord is None:
+        flow.MAP_finder(**({} if MAP_kwargs is None else MAP_kwargs))
+        save_flow(flow, path, key=key)
+    # the sample pool lives next to the flow checkpoint:
+    flow.sample_pool_dir = path
+    #
+    return flow, key
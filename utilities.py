@@ -3,6 +3,7 @@ Things that we will add to tensiometer utilities
 """
 
 import numpy as np
+from scipy.integrate import simps
 from getdist import plots
 
 def covariance_around(samples, center, weights=None):
@@ -27,3 +28,36 @@ def covariance_around(samples, center, weights=None):
     cov /= np.sum(weights)
     #
     return cov
+
+
+def get_levels(P, x, y, conf=[0.95, 0.68], use_simpson=True):
+    """
+    Get levels from a 2D grid.
+    The probability mass of each grid cell is computed once, cells are sorted by density and all levels are read off the cumulative mass.
+
+    :param P: density on the grid, with shape (len(y), len(x)), as given by :func:`numpy.meshgrid`.
+    :param x: grid points along the second axis of `P`.
+    :param y: grid points along the first axis of `P`.
+    :param conf: confidence levels, defaults to [0.95, 0.68].
+    :param use_simpson: whether to weight cells with the Simpson rule, which gives the same levels as integrating with :func:`scipy.integrate.simps`, or with the cell areas. Defaults to True.
+    :return: sorted array of density levels.
+    :raises ValueError: if a confidence level is outside the range of probability mass of the grid.
+    """
+    # weights of the grid points:
+    if use_simpson:
+        weights = np.outer(simps(np.eye(len(y)), y), simps(np.eye(len(x)), x))
+    else:
+        weights = np.outer(np.gradient(y), np.gradient(x))
+    # sort cells by density and accumulate mass:
+    P = np.asarray(P).ravel()
+    idx = np.argsort(P)[::-1]
+    sorted_P = P[idx]
+    mass = np.cumsum((P*weights.ravel())[idx])
+    # find levels:
+    levs = []
+    for c in conf:
+        if c > mass[-1] or c < mass[0]:
+            raise ValueError('Cannot generate proper levels, confidence level {} is outside the probability mass range [{}, {}] of the grid'.format(c, mass[0], mass[-1]))
+        levs.append(sorted_P[np.searchsorted(mass, c)])
+    levs = np.sort(levs)
+    return levs